@@ -1,141 +1,164 @@
 import time
+import instrumentation
+import str_catalogue
 from helpers import *
-from os.path import exists
 from data_variables import *
 from improved_helpers import *
 
 logger.basicConfig(level=logger.INFO,format='> %(message)s')
 
-def map_reads_snps(reads, hashed_reference_map, reference):
+def map_reads_snps(read_batches, hashed_reference_map, reference, snp_key, cache_folder=cache_folder,
+                   workers=WORKERS):
     """
+    :param read_batches: batches of paired-end reads from read_pairs_in_batches
+    :param snp_key: stage key of the SNPs, from the reads, the index and the mapping parameters
+    :param cache_folder: location of the stage cache
+    :param workers: number of worker processes
     :return: map reads to get SNPs
     """
-    if exists(SNP_file_path):
-        logger.info("Loading SNPs from {}".format(SNP_file_path))
-        SNPs = cPickle.load(open(SNP_file_path, "rb"))  # get existing SNPs if present
+    cached = load_stage(cache_folder, 'snps', snp_key)
+    if cached is not None:
+        logger.info("Loading SNPs from the cache")  # get existing SNPs if present
+        SNPs = [[reference_base, donor_base, position] for reference_base, donor_base, position in
+                zip(cached['reference_bases'].tolist(), cached['donor_bases'].tolist(), cached['positions'].tolist())]
     else:
         logger.info("Finding SNPs in the donor")
+        half_mapped_reads = []
         unmapped_reads = []
+        insert_sizes = InsertSizeModel()
         start = time.clock()
-
-        for count, read in enumerate(reads):
-            if count % 1000 == 0 and count != 0:
-                logger.info(
-                    "Mapping reads to reference. Completed {} %".format(str(100 * count / float(len(reads)))[:5]))
-                logger.info("Reads remaining : {0}".format(str(len(reads) - count)))
-
-            read = read.strip().split(',')
-
-            if len(read[0]) != 50 or len(read[1]) != 50:
-                continue
-
-            check_read_1 = map_read_to_reference(read[0], hashed_reference_map, reference)  # map read
-            reverse_read_1 = False
-            if not check_read_1:
-                check_read_1 = map_read_to_reference(read[0][::-1], hashed_reference_map, reference) # map reverse read
-                reverse_read_1 = True
-
-            check_read_2 = map_read_to_reference(read[1], hashed_reference_map, reference)
-            reverse_read_2 = False
-
-            if not check_read_2:
-                check_read_2 = map_read_to_reference(read[1][::-1], hashed_reference_map, reference)
-                reverse_read_2 = True
-
-            # only one of them is matched
-            # if reversed then other one would not be reversed
-            if (bool(check_read_1) == False and bool(check_read_2) == True) or \
-                    (bool(check_read_1) == True and bool(check_read_2) == False):
-                if bool(check_read_1):
-                    if reverse_read_1:        recheck_read = read[1][::-1]
-                    else:                     recheck_read = read[1]
-                    check_position = check_read_1
-                else:
-                    if reverse_read_2:        recheck_read = read[0][::-1]
-                    else:                     recheck_read = read[0]
-                    check_position = check_read_2
-
-                unmapped_reads.append([recheck_read[::-1], check_position - 200, check_position + 200])
+        count = 0
+
+        # map batches across worker processes and combine their variations in batch order
+        with instrumentation.stage('mapping') as record:
+            mapped_batches = run_in_pool(map_read_batch, read_batches, workers,
+                                         hashed_reference_map=hashed_reference_map, reference=reference)
+            for progress, batch_size, variations, batch_half_mapped_reads, batch_insert_sizes in mapped_batches:
+                merge_variations(variations)
+                half_mapped_reads.extend(batch_half_mapped_reads)
+                insert_sizes.merge(batch_insert_sizes)
+
+                count += batch_size
+                logger.info("Mapping reads to reference. Completed {} %".format(str(100 * progress)[:5]))
+                logger.info("Reads mapped : {0}".format(count))
+            record.items = count
+
+        # place the other end of half-mapped reads near its partner using the learned insert size
+        logger.info("Rescuing {} mates - insert size {} +/- {}".format(
+            len(half_mapped_reads), str(insert_sizes.mean())[:6], str(insert_sizes.deviation())[:6]))
+        shards = (half_mapped_reads[i:i + INDEL_SHARD_SIZE] for i in xrange(0, len(half_mapped_reads), INDEL_SHARD_SIZE))
+        with instrumentation.stage('mate_rescue') as record:
+            record.items = len(half_mapped_reads)
+            for variations, shard_unmapped_reads in run_in_pool(rescue_mate_shard, shards, workers,
+                                                                reference=reference, insert_sizes=insert_sizes):
+                merge_variations(variations)
+                unmapped_reads.extend(shard_unmapped_reads)
+        logger.info("Mates left for indel checks : {}".format(len(unmapped_reads)))
 
         SNPs = get_snps(reference)
-        logger.info("Dumping Unmapped Reads at {}".format(unmapped_read_file_path))
-        cPickle.dump(unmapped_reads, open(unmapped_read_file_path, "wb"))
-        logger.info("Dumping SNPs at {}".format(SNP_file_path))
-        cPickle.dump(SNPs, open(SNP_file_path, "wb"))
+        logger.info("Caching SNPs and {} unmapped reads".format(len(unmapped_reads)))
+        mates, mate_offsets = pack_strings([unmapped[0] for unmapped in unmapped_reads])
+        store_stage(cache_folder, 'snps', snp_key, {
+            'reference_bases': np.array([snp[0] for snp in SNPs], dtype='S1'),
+            'donor_bases': np.array([snp[1] for snp in SNPs], dtype='S1'),
+            'positions': np.array([snp[2] for snp in SNPs], dtype=np.int64),
+            'unmapped_reads': mates,
+            'unmapped_offsets': mate_offsets,
+            'unmapped_windows': np.array([unmapped[1:] for unmapped in unmapped_reads], dtype=np.int64).reshape(-1, 2)})
 
     return SNPs
 
 
-def map_reads_indels(reference):
+def map_reads_indels(reference, snp_key, indel_key, cache_folder=cache_folder, workers=WORKERS):
     """
+    :param snp_key: stage key of the SNPs, whose unmapped reads are checked
+    :param indel_key: stage key of the INDELs
+    :param cache_folder: location of the stage cache
+    :param workers: number of worker processes
     :return: check unmapped reads for indels
     """
-    if exists(INDEL_file_path):
-        logger.info("Loading INDELs from {}".format(INDEL_file_path))
-        indels = cPickle.load(open(INDEL_file_path, "rb"))
-        return indels
-
-    if exists(unmapped_read_file_path):
-        logger.info("Loading Unmapped Reads from {}".format(unmapped_read_file_path))
-        unmapped_reads = cPickle.load(open(unmapped_read_file_path, "rb"))
+    cached = load_stage(cache_folder, 'indels', indel_key)
+    if cached is not None:
+        logger.info("Loading INDELs from the cache")
+        return tuple(zip(unpack_strings(cached[name + '_strings'], cached[name + '_offsets']),
+                         cached[name + '_positions'].tolist()) for name in ('insertions', 'deletions'))
+
+    cached = load_stage(cache_folder, 'snps', snp_key)
+    if cached is not None:
+        logger.info("Loading Unmapped Reads from the cache")
+        unmapped_reads = [[mate, start_ref, end_ref] for mate, (start_ref, end_ref) in
+                          zip(unpack_strings(cached['unmapped_reads'], cached['unmapped_offsets']),
+                              cached['unmapped_windows'].tolist())]
         logger.info("Checking {} unmapped reads for insertions / deletions".format(len(unmapped_reads)))
         start = time.clock()
 
-        for count, unmapped in enumerate(unmapped_reads):
-            if count % 1000 == 0 and count != 0:
+        # align shards of unmapped reads across worker processes
+        shards = (unmapped_reads[i:i + INDEL_SHARD_SIZE] for i in xrange(0, len(unmapped_reads), INDEL_SHARD_SIZE))
+        count = 0
+        with instrumentation.stage('indel_alignment') as record:
+            record.items = len(unmapped_reads)
+            for insertions, deletions in run_in_pool(check_indel_shard, shards, workers, reference=reference):
+                merge_indels(insertions, deletions)
+
+                count = min(len(unmapped_reads), count + INDEL_SHARD_SIZE)
                 logger.info("Mapping reads to reference. Completed {} %".format(
                     str(100 * count / float(len(unmapped_reads)))[:5]))
                 logger.info("Reads remaining : {0}".format(str(len(unmapped_reads) - count)))
 
-            check_for_indels(unmapped[0], reference, unmapped[1], unmapped[2])
-
         ins = get_insertions()
         DEL = get_deletions()
 
-        logger.info("Dumping INDELs at {}".format(INDEL_file_path))
-        cPickle.dump((ins, DEL), open(INDEL_file_path, "wb"))
+        logger.info("Caching INDELs")
+        stage = {}
+        for name, indels in (('insertions', ins), ('deletions', DEL)):
+            stage[name + '_strings'], stage[name + '_offsets'] = pack_strings([indel[0] for indel in indels])
+            stage[name + '_positions'] = np.array([indel[1] for indel in indels], dtype=np.int64)
+        store_stage(cache_folder, 'indels', indel_key, stage)
 
         return ins, DEL
     else:
-        logger.info("Run STR Code first to get unmapped reads")
-        exit()
+        raise KeyError("SNP stage {} is not in the cache - map the reads before checking them for indels".format(
+            snp_key))
 
 
 if __name__ == "__main__":
     start_time = time.clock()
 
     logger.info("Reading Reference File : {}".format(reference_file_name[dataset_choice]))
-    reference = read_reference_file(reference_file_path)  # read the reference file
+    reference = load_reference(reference_file_path)  # memory-map the reference file
     logger.info("Length of Reference Sequence : {}".format(len(reference)))
 
     logger.info("Reading Reads File : {}".format(reads_file_name[dataset_choice]))
-    reads = read_reads_file(reads_file_path) # read the read file
-    logger.info("Number of Paired-End Reads : {}".format(len(reads)))
+    reads = read_pairs_in_batches(reads_file_path)  # stream the read file
 
-    hashed_reference_map = created_hashed_map(reference, hashed_file_path)  # create hash map of reference
-    SNPs = map_reads_snps(reads, hashed_reference_map, reference)  # get SNPs by mapping reads
-    SNPs = process_snps(SNPs)  # process the SNPs
+    index_key, snp_key, indel_key = get_stage_keys(reference, reference_file_path, reads_file_path, cache_folder)
+    hashed_reference_map = created_hashed_map(reference, cache_folder, index_key)  # create hash map of reference
 
-    INDELs = map_reads_indels(reference)  # get INDELs by checking unmapped reads
-    processed_INDELs = (process_indels(INDELs[0]), process_indels(INDELs[1]))  # process the INDELs
+    # write each section of the output as soon as its stage completes
+    output_file_name = "improved_" + file_name[dataset_choice]
+    with VariantWriter(output_file_name, variant_file_name(output_file_name)) as writer:
+        SNPs = map_reads_snps(reads, hashed_reference_map, reference, snp_key)  # get SNPs by mapping reads
+        SNPs = process_snps(SNPs)  # process the SNPs
+        writer.write_section('SNP', SNPs)
 
-    donor,reference_location = create_donor_sequence(reference, SNPs, processed_INDELs)  # recreate donor sequence
+        INDELs = map_reads_indels(reference, snp_key, indel_key)  # get INDELs by checking unmapped reads
+        processed_INDELs = (process_indels(INDELs[0]), process_indels(INDELs[1]))  # process the INDELs
+        writer.write_section('DEL', processed_INDELs[0])
+        writer.write_section('INS', processed_INDELs[1])
 
-    STRs = get_tandem_repeats(donor)  # get STRs from donor genome
-    STRs = find_reference_position(STRs, reference_location)  # get corresponding reference location
+        donor, donor_assembly = create_donor_sequence(reference, SNPs, processed_INDELs)  # recreate donor sequence
+
+        # get STRs from donor genome - reference STRs are reused away from the variants
+        catalogue = str_catalogue.get_str_catalogue(reference_file_path, cache_folder)
+        STRs = get_incremental_tandem_repeats(reference, catalogue, donor, donor_assembly, SNPs, processed_INDELs)
+        STRs = find_reference_position(STRs, donor_assembly)  # get corresponding reference location
+        writer.write_section('STR', STRs)
 
     logger.info("Total Number of SNPs : {}".format(len(SNPs)))
     logger.info("Total Number of INS : {}".format(len(processed_INDELs[1])))
     logger.info("Total Number of DEL : {}".format(len(processed_INDELs[0])))
     logger.info("Total Number of STRs : {}".format(len(STRs)))
 
-    # combine outputs into dictionary
-    output = defaultdict()
-    output['SNP'] = SNPs
-    output['STR'] = STRs
-    output['DEL'] = processed_INDELs[0]
-    output['INS'] = processed_INDELs[1]
-
-    output_to_file(output, "improved_" + file_name[dataset_choice])
+    instrumentation.write_report(instrumentation.report_file_name(output_file_name))  # timings of every stage
     logger.info("Time to execute {} secs".format(time.clock() - start_time))
     logger.info("Process completed")
@@ -0,0 +1,233 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import subprocess
+import numpy as np
+import logging as logger
+from helpers import *
+from improved_helpers import *
+from pileup import Pileup
+from synthetic_data import SyntheticGenome, score_calls, READ_LENGTH as SYNTHETIC_READ_LENGTH
+from variant_writer import read_output_file
+
+logger.basicConfig(level=logger.INFO, format='> %(message)s')
+
+STR_FINDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'str_finder.py')
+GENOME_SIZES = '20000,100000,500000'  # reference lengths benchmarked, for the scaling curves
+SAMPLE_SIZE = 2000  # reads or alignments timed by the benchmarks of single functions
+ALIGNMENT_FLANK = 10  # reference bases on both sides of a read aligned around a planted indel
+
+
+def best_time(function, repeat):
+    """
+    :return: shortest wall time of repeat calls of function, and the result of the last call
+    """
+    best, result = None, None
+    for _ in xrange(repeat):
+        start = time.time()
+        result = function()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def timing(seconds, items):
+    return {'secs': round(seconds, 6), 'items': items, 'items_per_sec': round(items / seconds, 3) if seconds else 0.0}
+
+
+def read_sample(reads_file_name, size):
+    """
+    :return: first ends of the first size pairs of a reads file
+    """
+    reads = []
+    for _, batch in read_pairs_in_batches(reads_file_name, size):
+        reads = [read[0] for read in batch]
+        break
+    return reads
+
+
+def alignment_sample(genome, size):
+    """
+    :return: (reference window, donor read) pairs around planted indels, as the indel checks align them
+    """
+    # donor position of each reference position of an indel - shifted by the indels before it
+    events = sorted([(position, len(string)) for string, position in genome.insertions] +
+                    [(position, -len(string)) for string, position in genome.deletions])
+    pairs, shift = [], 0
+    for position, length in events:
+        donor_position = position + shift
+        read_start = max(0, donor_position - SYNTHETIC_READ_LENGTH / 2)
+        read = genome.donor[read_start:read_start + SYNTHETIC_READ_LENGTH]
+        window_start = max(0, read_start - shift - ALIGNMENT_FLANK)
+        pairs.append((genome.reference[window_start:window_start + SYNTHETIC_READ_LENGTH + 2 * ALIGNMENT_FLANK], read))
+        shift += length
+    return (pairs * (size / max(1, len(pairs)) + 1))[:size] if pairs else []
+
+
+def benchmark_functions(genome, reference_file_name, reads_file_name, folder, repeat, sample_size):
+    """
+    :return: timings of the hot functions on their own, with checks of their results against the planted truth
+    """
+    results = {}
+    reference = load_reference(reference_file_name)
+
+    seconds, tandem_repeats = best_time(lambda: get_reference_tandem_repeats(genome.reference), repeat)
+    results['get_reference_tandem_repeats'] = timing(seconds, len(genome.reference))
+    STRs = preprocess_tandems(tandem_repeats)
+    results['get_reference_tandem_repeats'].update(score_calls(genome.STRs, STRs))
+
+    cache_folder = os.path.join(folder, 'function_cache')
+
+    def build_index():
+        shutil.rmtree(cache_folder, ignore_errors=True)  # always build, never load
+        return created_hashed_map(reference, cache_folder, get_index_key(reference, reference_file_name, cache_folder))
+    seconds, index = best_time(build_index, repeat)
+    results['created_hashed_map'] = timing(seconds, len(reference))
+
+    reads = read_sample(reads_file_name, sample_size)
+    seconds, mapped = best_time(lambda: [map_read_to_reference(read, index, reference, Pileup()) for read in reads],
+                                repeat)
+    results['map_read_to_reference'] = timing(seconds, len(reads))
+    results['map_read_to_reference']['mapped'] = round(
+        sum(match is not None for match in mapped) / float(max(1, len(reads))), 4)
+
+    pairs = alignment_sample(genome, sample_size / 10)
+    seconds, _ = best_time(lambda: [waterman_algorithm(window, read) for window, read in pairs], repeat)
+    results['waterman_algorithm'] = timing(seconds, len(pairs))
+
+    INDELs = (genome.deletions, genome.insertions)
+    seconds, (donor, donor_assembly) = best_time(lambda: create_donor_sequence(reference, genome.SNPs, INDELs),
+                                                 repeat)
+    results['create_donor_sequence'] = timing(seconds, len(genome.SNPs) + len(genome.insertions) +
+                                              len(genome.deletions))
+    results['create_donor_sequence']['matches_truth'] = donor == genome.donor
+
+    donor_STRs = preprocess_tandems(get_reference_tandem_repeats(donor))
+    seconds, STRs = best_time(lambda: find_reference_position(donor_STRs, donor_assembly), repeat)
+    results['find_reference_position'] = timing(seconds, len(donor_STRs))
+    results['find_reference_position'].update(score_calls(genome.STRs, STRs))
+
+    return results
+
+
+def benchmark_entry_point(command, reference_file_name, reads_file_name, truth, folder, workers):
+    """
+    :return: wall time, stage report and recall of every section of a str-finder command run in its own process
+    """
+    output_file_name = os.path.join(folder, command + '_output.txt')
+    report_file_name = os.path.join(folder, command + '_report.json')
+    arguments = [sys.executable, STR_FINDER, command, '--reference', reference_file_name, '--workers', str(workers),
+                 '--output', output_file_name, '--report', report_file_name]
+    if command != 'baseline':
+        arguments += ['--reads', reads_file_name, '--cache', os.path.join(folder, command + '_cache')]
+        shutil.rmtree(os.path.join(folder, command + '_cache'), ignore_errors=True)
+
+    start = time.time()
+    with open(os.path.join(folder, command + '.log'), 'w') as log:
+        subprocess.check_call(arguments, stdout=log, stderr=subprocess.STDOUT)
+    seconds = time.time() - start
+
+    calls = read_output_file(output_file_name)
+    with open(report_file_name) as f:
+        report = json.load(f)
+
+    result = {'secs': round(seconds, 6), 'stages': report['stages'], 'counters': report['counters']}
+    for key in ('SNP', 'INS', 'DEL', 'STR'):
+        if calls.get(key) or key == 'STR':
+            result[key] = score_calls(truth[key], calls.get(key, []))
+    return result
+
+
+def scaling_exponents(runs):
+    """
+    :return: slope of log time against log genome size of every benchmark - 1 is linear scaling
+    """
+    if len(runs) < 2:
+        return {}
+    sizes = np.log([run['genome_size'] for run in runs])
+    exponents = {}
+    for group in ('functions', 'entry_points'):
+        for name in runs[0][group]:
+            seconds = np.array([run[group][name]['secs'] for run in runs])
+            if np.all(seconds > 0):
+                exponents[name] = round(float(np.polyfit(sizes, np.log(seconds), 1)[0]), 3)
+    return exponents
+
+
+def lowest_recall(runs):
+    """
+    :return: lowest recall of any checked result in any run
+    """
+    recalls = [1.0]
+    for run in runs:
+        for name, result in run['functions'].items():
+            recalls.append(result.get('recall', 1.0))
+        for name, result in run['entry_points'].items():
+            recalls.extend(result[key]['recall'] for key in ('SNP', 'INS', 'DEL', 'STR') if key in result)
+    return min(recalls)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the STR finder on synthetic genomes with planted variants")
+    parser.add_argument('--genome-sizes', default=GENOME_SIZES, help="comma separated reference lengths")
+    parser.add_argument('--coverage', type=float, default=20, help="average reads covering a donor base")
+    parser.add_argument('--error-rate', type=float, default=0.001, help="chance of a sequencing error per base")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the synthetic genomes and reads")
+    parser.add_argument('--repeat', type=int, default=3, help="runs of each function - the fastest is kept")
+    parser.add_argument('--sample-size', type=int, default=SAMPLE_SIZE, help="reads timed by the mapping benchmark")
+    parser.add_argument('--workers', type=int, default=WORKERS, help="worker processes of the entry points")
+    parser.add_argument('--folder', default='benchmark_data', help="location of the synthetic data")
+    parser.add_argument('--output', default='benchmark.json', help="JSON report of every timing and recall")
+    parser.add_argument('--min-recall', type=float, default=0.0, help="fail if any recall is lower")
+    parser.add_argument('--skip-entry-points', action='store_true', help="only benchmark single functions")
+    args = parser.parse_args(argv)
+
+    runs = []
+    for genome_size in [int(size) for size in args.genome_sizes.split(',')]:
+        folder = os.path.join(args.folder, str(genome_size))
+        genome = SyntheticGenome(genome_size, args.seed)
+        reference_file_name, reads_file_name, _ = genome.write_dataset(folder, args.coverage, args.error_rate)
+
+        logger.getLogger().setLevel(logger.WARNING)  # keep the pipeline quiet while it is timed
+        try:
+            run = {'genome_size': genome_size,
+                   'functions': benchmark_functions(genome, reference_file_name, reads_file_name, folder, args.repeat,
+                                                    args.sample_size),
+                   'entry_points': {}}
+            if not args.skip_entry_points:
+                for command in ('baseline', 'improved'):
+                    run['entry_points'][command] = benchmark_entry_point(command, reference_file_name,
+                                                                         reads_file_name, genome.truth(), folder,
+                                                                         args.workers)
+        finally:
+            logger.getLogger().setLevel(logger.INFO)
+        runs.append(run)
+
+        for group in ('functions', 'entry_points'):
+            for name, result in sorted(run[group].items()):
+                checks = ', '.join("{} recall {}".format(key, result[key]['recall'])
+                                   for key in ('SNP', 'INS', 'DEL', 'STR') if key in result)
+                if 'recall' in result:
+                    checks = "recall {}".format(result['recall'])
+                logger.info("{:>10} bases  {:<30} {:>10.4f} secs  {}".format(genome_size, name, result['secs'],
+                                                                            checks))
+
+    summary = {'coverage': args.coverage, 'error_rate': args.error_rate, 'seed': args.seed, 'runs': runs,
+               'scaling_exponents': scaling_exponents(runs)}
+    with open(args.output, 'w') as f:
+        json.dump(summary, f, indent=2, sort_keys=True)
+        f.write('\n')
+    for name, exponent in sorted(summary['scaling_exponents'].items()):
+        logger.info("Scaling of {} : time ~ size ^ {}".format(name, exponent))
+
+    recall = lowest_recall(runs)
+    if recall < args.min_recall:
+        logger.info("Lowest recall {} is below {}".format(recall, args.min_recall))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
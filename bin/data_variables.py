@@ -10,7 +10,11 @@ reads_file_name = ['Practice/reads_practice_E_1_chr_1.txt', 'Undergraduate/reads
 reference_file_path = join(base_folder, reference_file_name[dataset_choice])
 reads_file_path = join(base_folder, reads_file_name[dataset_choice])
 
-hashed_file_path = join(base_folder, "Hashed/hashed_" + file_name[dataset_choice])  # hashed map location
-SNP_file_path = join(base_folder, "SNPs/snps_" + file_name[dataset_choice])  # snps location
-INDEL_file_path = join(base_folder, "INDELs/indels_" + file_name[dataset_choice])  # indel location
-unmapped_read_file_path = join(base_folder, "Unmapped/unmapped_" + file_name[dataset_choice])  # unmapped reads location
+cache_folder = join(base_folder, "Cache")  # cached results of the pipeline stages
+
+
+def dataset_paths(choice, folder=base_folder):
+    """
+    :return: reference file, reads file and base output file name of a dataset
+    """
+    return join(folder, reference_file_name[choice]), join(folder, reads_file_name[choice]), file_name[choice]
@@ -0,0 +1,140 @@
+from bisect import bisect_right
+import numpy as np
+
+
+class DonorAssembly(object):
+    """
+    Donor sequence described as pieces - reference segments and inserted strings - in donor order.
+    Coordinates are translated with a binary search over the piece starts, so memory grows with
+    the number of variants rather than the length of the genome.
+    """
+
+    def __init__(self, reference, SNPs, insertions, deletions):
+        """
+        :param reference: reference genome
+        :param SNPs: [reference base, donor base, position] of each SNP
+        :param insertions: (inserted string, position) - the string goes in before the reference position
+        :param deletions: (deleted string, position) - the reference bases from position on are removed
+        """
+        self.reference = reference
+        self.snp_positions = sorted(int(snp[2]) for snp in SNPs)
+        self.snp_bases = dict((int(snp[2]), snp[1]) for snp in SNPs)
+
+        # indels in reference order, an insertion goes before a deletion at the same position
+        events = [(int(ins[1]), 0, ins[0]) for ins in insertions] + [(int(dels[1]), 1, dels[0]) for dels in deletions]
+        events.sort()
+
+        donor_starts, reference_starts, sites, lengths, inserted = [], [], [], [], []
+
+        def add_piece(reference_start, length, insert_string, site):
+            if length > 0:
+                donor_starts.append(donor_starts[-1] + lengths[-1] if lengths else 0)
+                reference_starts.append(reference_start)
+                sites.append(site)
+                lengths.append(length)
+                inserted.append(insert_string)
+
+        cursor = 0  # next reference base to place in the donor
+        for position, is_deletion, string in events:
+            if position < cursor or position > len(reference):  # inside an earlier deletion
+                continue
+            add_piece(cursor, position - cursor, None, cursor)
+            cursor = position
+            if is_deletion:
+                cursor = min(len(reference), position + len(string))
+            else:
+                add_piece(-1, len(string), string, position)
+        add_piece(cursor, len(reference) - cursor, None, cursor)
+
+        self.donor_starts = np.array(donor_starts, dtype=np.int64)
+        self.reference_starts = np.array(reference_starts, dtype=np.int64)
+        self.sites = np.array(sites, dtype=np.int64)  # reference start of a piece, or where an insertion goes
+        self.lengths = np.array(lengths, dtype=np.int64)
+        self.inserted = inserted
+
+        # reference pieces alone, in reference order, for the forward translation
+        from_reference = self.reference_starts >= 0
+        self.reference_piece_starts = self.reference_starts[from_reference]
+        self.reference_piece_donor_starts = self.donor_starts[from_reference]
+        self.reference_piece_lengths = self.lengths[from_reference]
+
+    def __len__(self):
+        return int(self.lengths.sum())
+
+    def sequence(self):
+        """
+        :return: donor sequence
+        """
+        parts = []
+        for reference_start, length, insert_string in zip(self.reference_starts.tolist(), self.lengths.tolist(),
+                                                          self.inserted):
+            if insert_string is not None:
+                parts.append(insert_string)
+                continue
+
+            part = bytearray(self.reference[reference_start:reference_start + length])
+            first = bisect_right(self.snp_positions, reference_start - 1)
+            last = bisect_right(self.snp_positions, reference_start + length - 1)
+            for position in self.snp_positions[first:last]:
+                part[position - reference_start] = self.snp_bases[position]
+            parts.append(str(part))
+
+        return ''.join(parts)
+
+    def reference_to_donor(self, position):
+        """
+        :return: donor position of a reference position, the first donor base after it if it was deleted
+        """
+        piece = bisect_right(self.reference_piece_starts, position) - 1
+        if piece < 0:
+            return 0
+        offset = min(position - int(self.reference_piece_starts[piece]), int(self.reference_piece_lengths[piece]))
+        return int(self.reference_piece_donor_starts[piece]) + offset
+
+    def reference_to_donor_batch(self, positions):
+        """
+        :param positions: reference positions
+        :return: donor position of every reference position, the first donor base after it if it was deleted
+        """
+        positions = np.asarray(positions, dtype=np.int64)
+        if not len(self.reference_piece_starts):
+            return np.zeros(len(positions), dtype=np.int64)
+        piece = np.searchsorted(self.reference_piece_starts, positions, side='right') - 1
+        offsets = np.minimum(positions - self.reference_piece_starts[np.maximum(piece, 0)],
+                             self.reference_piece_lengths[np.maximum(piece, 0)])
+        return np.where(piece >= 0, self.reference_piece_donor_starts[np.maximum(piece, 0)] + offsets, 0)
+
+    def donor_to_reference(self, position):
+        """
+        :return: reference position of a donor position, None if the base was inserted or lies outside the donor
+        """
+        piece = bisect_right(self.donor_starts, position) - 1
+        if piece < 0 or position >= int(self.donor_starts[piece] + self.lengths[piece]):
+            return None
+        if self.inserted[piece] is not None:
+            return None
+        return int(self.reference_starts[piece]) + position - int(self.donor_starts[piece])
+
+    def donor_to_reference_batch(self, positions, insertion_sites=False):
+        """
+        :param positions: donor positions
+        :param insertion_sites: give inserted bases the reference position their insertion goes before
+        :return: reference position of every donor position, -1 where the base lies outside the donor
+                 or was inserted, unless insertion sites are asked for
+        """
+        positions = np.asarray(positions, dtype=np.int64)
+        piece = np.searchsorted(self.donor_starts, positions, side='right') - 1
+        valid = piece >= 0
+        piece = np.maximum(piece, 0)
+
+        if len(self.lengths):
+            valid &= positions < self.donor_starts[piece] + self.lengths[piece]
+            from_reference = self.reference_starts[piece] >= 0
+            if not insertion_sites:
+                valid &= from_reference
+            locations = np.where(from_reference, self.reference_starts[piece] + positions - self.donor_starts[piece],
+                                 self.sites[piece])
+        else:
+            locations = positions
+
+        return np.where(valid, locations, -1)
@@ -1,34 +1,65 @@
-import re
+import io
+import os
+import gzip
+import string
 import logging as logger
 from itertools import groupby
 from itertools import product
 from operator import itemgetter
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
+import numpy as np
+import instrumentation
+from reference import *
+from parallel_helpers import *
+from variant_writer import *
 
 logger.basicConfig(level=logger.INFO,format='> %(message)s')
 
 STR_THRESHOLD = 5  # threshold limit of STR length
+READ_BATCH_SIZE = 10000  # paired-end reads read from disk at once
+STR_WINDOW = 1 << 22  # bases checked for STRs by a worker at once
+WINDOW_SEPARATOR = '012345'  # joins windows scanned together - its characters never match each other or a base
+COMPLEMENT = string.maketrans('ACGTacgt', 'TGCAtgca')
 
-def read_reads_file(reads_file_loc):
+
+def read_pairs_in_batches(reads_file_loc, batch_size=READ_BATCH_SIZE):
     """
-    :param reads_file_loc: location of the reads file
-    :return: list of all the paired-ends reads
+    :param reads_file_loc: location of the reads file, gzip compressed if it ends with .gz
+    :param batch_size: number of paired-end reads in each batch
+    :return: generator of (fraction of the file read, batch of paired-end reads)
     """
-    input_reads = []
-    omit_first_line = True
+    total_size = float(max(1, os.path.getsize(reads_file_loc)))
+    raw_file = open(reads_file_loc, 'rb')
+    if reads_file_loc.endswith('.gz'):
+        read_file = io.BufferedReader(gzip.GzipFile(fileobj=raw_file))
+    else:
+        read_file = raw_file
+
+    try:
+        read_file.readline()  # omit first line of file
+        batch = []
+        for line in read_file:
+            read = line.strip().split(',')
+            if len(read) != 2:
+                continue
+            batch.append(read)
 
-    read_file = open(reads_file_loc, 'r')
-    while True:
-        lines = read_file.readlines(100000)
-        if not lines:
-            break
-        if omit_first_line:  # omit first line of file
-            omit_first_line = False
-            del lines[0]
+            if len(batch) == batch_size:
+                yield raw_file.tell() / total_size, batch
+                batch = []
 
-        input_reads.extend(lines)
+        if batch:
+            yield 1.0, batch
+    finally:
+        read_file.close()
+        raw_file.close()
 
-    return input_reads
+
+def reverse_complement(sequence):
+    """
+    :return: reverse complement of a DNA sequence
+    """
+    return sequence.translate(COMPLEMENT)[::-1]
 
 
 def read_reference_file(reference_file_name):
@@ -36,42 +67,29 @@ def read_reference_file(reference_file_name):
     :param reference_file_name: location of the reference file
     :return: reference genome
     """
-    reference_seq = ''
+    reference_seq = []
     omit_first_line = True
 
     with open(reference_file_name, 'r') as f:
-        for line in f.readlines():
+        for line in f:
             if omit_first_line:  # omit first line of file
                 omit_first_line = False
                 continue
-            reference_seq += line.strip()
+            reference_seq.append(line.strip())
 
-    return reference_seq
+    return ''.join(reference_seq)
 
 
-def output_to_file(output, file_name):
+def output_to_file(output, file_name, indexed_file_name=None):
     """
     :param output: dictionary comprises of output variations
     :param file_name: output file name
+    :param indexed_file_name: location of the sorted, block-compressed variant file - not written if None
     :return: creates output file with all variants
     """
-    fopen = open(file_name, "wb")
-
-    fopen.write(">" + file_name.split('.')[0] + "\n")
-    for key in output:
-        fopen.write(">{}".format(key) + "\n")
-        if key == "SNP":
-            for i in output[key]:
-                fopen.write(i[0] + "," + i[1] + "," + str(i[2]) + "\n")
-        elif key == "STR":
-            for i in output[key]:
-                fopen.write(i[0] + "," + str(i[1]) + "\n")
-        elif key == "INS" or key == "DEL":
-            for i in output[key]:
-                fopen.write(i[0] + "," + str(i[1]) + "\n")
-
-    tails = ('>' + x for x in ('CNV', 'ALU', 'INV'))
-    fopen.write('\n'.join(tails))
+    with VariantWriter(file_name, indexed_file_name) as writer:
+        for key in output:
+            writer.write_section(key, output[key])
 
 
 def tandem_combos(repeat):
@@ -123,6 +141,118 @@ def preprocess_tandems(tandem_repeats):
     return processed_tandem_repeats
 
 
+def find_periodic_stretches(genome, period, start=0, end=None):
+    """
+    :param genome: genome sequence
+    :param period: length of the repeating unit
+    :param start: first position to check
+    :param end: position to stop checking at - the period bases after it are read too
+    :return: first and last (exclusive) index of every stretch where genome[i] == genome[i + period]
+    """
+    sequence = as_byte_array(genome)
+    end = len(sequence) if end is None else min(end, len(sequence))
+    compared = max(0, min(end, len(sequence) - period) - start)
+    window = sequence[start:start + compared + period]
+
+    same = np.concatenate(([False], window[:compared] == window[period:period + compared], [False]))
+    edges = np.flatnonzero(same[1:] != same[:-1]) + start  # alternating starts and ends of periodic stretches
+
+    return edges[0::2], edges[1::2]
+
+
+def stitch_stretches(firsts, lasts):
+    """
+    :return: periodic stretches from neighbouring windows joined where one ends exactly where the next starts
+    """
+    if not len(firsts):
+        return firsts, lasts
+    order = np.argsort(firsts, kind='mergesort')
+    firsts, lasts = firsts[order], lasts[order]
+    new_stretch = np.concatenate(([True], firsts[1:] != lasts[:-1]))
+    stretch_ends = np.concatenate((np.flatnonzero(new_stretch)[1:] - 1, [len(firsts) - 1]))
+
+    return firsts[new_stretch], lasts[stretch_ends]
+
+
+def find_periodic_regions(genome, period, stretches=None):
+    """
+    :param genome: genome sequence
+    :param period: length of the repeating unit
+    :param stretches: periodic stretches of the genome if already found
+    :return: (start, end) of every region where genome[i] == genome[i + period] holds long enough
+             for STR_THRESHOLD copies of a unit
+    """
+    starts, ends = find_periodic_stretches(genome, period) if stretches is None else stretches
+    keep = ends - starts >= period * (STR_THRESHOLD - 1)
+
+    return zip(starts[keep].tolist(), (ends[keep] + period).tolist())
+
+
+def scan_tandem_repeats(genome, STR_LENGTH, regions=None):
+    """
+    :param genome: genome sequence
+    :param STR_LENGTH: length of the STR unit
+    :param regions: periodic regions of the genome if already found
+    :return: start-index and number of repeats of every STR of specified length
+    """
+    tandem_repeats = defaultdict(list)
+    if regions is None:
+        regions = find_periodic_regions(genome, STR_LENGTH)
+
+    # a single pass over the genome finds every region that repeats with this period
+    for start, end in regions:
+        seen = set()
+        # each rotation of the unit inside the region is a separate STR
+        for index in xrange(start, start + STR_LENGTH):
+            STR = genome[index:index + STR_LENGTH]
+            if STR in seen or STR.strip('ACGT'):  # same unit seen earlier or not a valid base
+                continue
+            seen.add(STR)
+
+            repeats = (end - index) // STR_LENGTH
+            if repeats >= STR_THRESHOLD:
+                tandem_repeats[STR].append((index, repeats))
+
+    # keep the order of the exhaustive motif search
+    return defaultdict(list, ((STR, tandem_repeats[STR]) for STR in sorted(tandem_repeats)))
+
+
+def canonical_motif(STR):
+    """
+    :param STR: STR unit
+    :return: lexicographically smallest rotation of the unit
+    """
+    return min(rotate(STR, n) for n in xrange(len(STR)))
+
+
+def merge_rotations(tandem_repeats):
+    """
+    :param tandem_repeats: start-index and number of repeats of STRs of one length
+    :return: (STR, start-index, repeats) sorted by position - rotations of the same unit that overlap
+             an earlier one are removed
+    """
+    hits = []
+    for STR in tandem_repeats:
+        family = canonical_motif(STR)
+        for index, repeats in tandem_repeats[STR]:
+            hits.append((family, index, -repeats, STR))
+    hits.sort()
+
+    merged = []
+    last_family, last_end = None, 0
+    for family, index, repeats, STR in hits:
+        repeats = -repeats  # longest first when two rotations start together
+        end = index + repeats * len(STR)
+        if family == last_family and index < last_end:  # overlaps a rotation that starts earlier
+            last_end = max(last_end, end)
+            continue
+        merged.append((STR, index, repeats))
+        last_family, last_end = family, end
+
+    merged.sort(key=itemgetter(1, 0))
+    return merged
+
+
 def get_reference_tandem_repeats(genome):
     """
     :param genome: genome sequence with STRs
@@ -134,63 +264,170 @@ def get_reference_tandem_repeats(genome):
     for STR_LENGTH in xrange(2, 6):
         logger.info("Checking STR of Length : {}".format(STR_LENGTH))
 
-        word_list = tandem_combos(STR_LENGTH)  # get all combos of STRs for specify length
-        temp_tandem_repeats = defaultdict(list)
-
-        for STR in word_list:  # consider each STR separately
-            indices = []
-
-            # append all occurrences of the STR in reference
-            for m in re.finditer(STR * STR_THRESHOLD, genome):
-                indices.append(m.start())
-
-            threshold = STR_LENGTH * STR_THRESHOLD
-            clean_indices = []
-
-            for index in range(len(indices)):
-                if index == 0:
-                    clean_indices.append(indices[index])
-                else:
-                    if indices[index] - indices[index - 1] > threshold:
-                        clean_indices.append(indices[index])
-
-            # loop through each start-index of STR
-            for index in clean_indices:
-                cur_pos = index
-                repeats = 0
-
-                # calculate actual number of repeats in the reference
-                while True:
-                    check = genome[cur_pos:cur_pos + STR_LENGTH]
-                    if check == STR:
-                        repeats += 1
-                    else:
-                        break
-                    cur_pos += STR_LENGTH
-
-                # append temporary found tandem repeats
-                temp_tandem_repeats[STR].append((index, repeats))
-
-        # loop through each temporary found tandem repeat
-        # delete complementary repeats whose index is greater
-        for STR in temp_tandem_repeats.keys():
-            current = temp_tandem_repeats[STR]
-            for each_index in current:
-                flag = False
-                for com in range(1, len(STR)):
-                    complement = temp_tandem_repeats[rotate(STR, com)]
-                    other_index = 0
-                    while other_index < len(complement):
-                        if abs(each_index[0] - complement[other_index][0]) < 10:
-                            if each_index[0] > complement[other_index][0]:
-                                flag = False
-                                short_tandem_repeats[rotate(STR, com)].append(complement[other_index])
-                                break
-                            else:
-                                temp_tandem_repeats[rotate(STR, com)].remove(complement[other_index])
-                                continue
-                        other_index += 1
-                if not flag:
-                    short_tandem_repeats[STR].append(each_index)
+        temp_tandem_repeats = scan_tandem_repeats(genome, STR_LENGTH)  # all STRs of specified length
+
+        # keep only the first of the overlapping rotations of a unit
+        for STR, index, repeats in merge_rotations(temp_tandem_repeats):
+            short_tandem_repeats[STR].append((index, repeats))
 
     return short_tandem_repeats
+
+
+def find_stretch_shard(job):
+    """
+    :param job: (genome number, period, start, end) - genome taken from SHARED genomes
+    :return: genome number, period and the periodic stretches between start and end that are long enough
+             for an STR or touch the window edges, where they may join the stretches of the next windows
+    """
+    record, period, start, end = job
+    genome = SHARED['genomes'][record]
+    starts, ends = find_periodic_stretches(genome, period, start, end)
+    keep = (ends - starts >= period * (STR_THRESHOLD - 1)) | (starts == start) | \
+        (ends == max(start, min(end, len(genome) - period)))
+    return record, period, starts[keep], ends[keep]
+
+
+def get_genome_tandem_repeats(genomes, workers=WORKERS, window=STR_WINDOW):
+    """
+    :param genomes: genome sequences, such as every record of a reference file
+    :param workers: number of worker processes
+    :param window: bases each worker checks at once
+    :return: STRs of every genome as get_reference_tandem_repeats finds them
+    """
+    jobs = [(record, STR_LENGTH, start, start + window) for record, genome in enumerate(genomes)
+            for STR_LENGTH in xrange(2, 6) for start in xrange(0, max(1, len(genome)), window)]
+    logger.info("Checking STRs of {} sequences in {} windows".format(len(genomes), len(jobs)))
+
+    with instrumentation.stage('str_detection') as record:
+        record.items = sum(len(genome) for genome in genomes)
+
+        stretches = defaultdict(list)
+        for record_id, STR_LENGTH, starts, ends in run_in_pool(find_stretch_shard, jobs, workers, genomes=genomes):
+            stretches[record_id, STR_LENGTH].append((starts, ends))
+
+        all_tandem_repeats = []
+        for record_id, genome in enumerate(genomes):
+            short_tandem_repeats = defaultdict(list)
+            for STR_LENGTH in xrange(2, 6):
+                starts = np.concatenate([window_starts for window_starts, _ in stretches[record_id, STR_LENGTH]])
+                ends = np.concatenate([window_ends for _, window_ends in stretches[record_id, STR_LENGTH]])
+                regions = find_periodic_regions(genome, STR_LENGTH, stitch_stretches(starts, ends))
+
+                # keep only the first of the overlapping rotations of a unit
+                for STR, index, repeats in merge_rotations(scan_tandem_repeats(genome, STR_LENGTH, regions)):
+                    short_tandem_repeats[STR].append((index, repeats))
+            all_tandem_repeats.append(short_tandem_repeats)
+
+    return all_tandem_repeats
+
+
+def get_reference_file_tandem_repeats(reference_file_name, workers=WORKERS, names=None):
+    """
+    :param reference_file_name: location of the reference file, which may hold several records
+    :param names: records to scan, all records if not given
+    :return: (record name, processed STRs in coordinate order) of every record in file order
+    """
+    references = load_reference_records(reference_file_name, names)
+    all_tandem_repeats = get_genome_tandem_repeats(references, workers)
+
+    return [(reference.name, sorted(preprocess_tandems(tandem_repeats), key=itemgetter(1)))
+            for reference, tandem_repeats in zip(references, all_tandem_repeats)]
+
+
+def output_reference_strs(record_STRs, file_name):
+    """
+    :param record_STRs: (record name, STRs) of every record, from get_reference_file_tandem_repeats
+    :param file_name: output file name - a reference with several records gets one file per record
+    :return: names of the output files written
+    """
+    file_names = []
+    for record, STRs in record_STRs:
+        record_file = file_name if len(record_STRs) == 1 else record_file_name(file_name, record)
+        logger.info("STRs of record {} : {}".format(record, len(STRs)))
+        output_to_file(OrderedDict([('STR', STRs), ('SNP', []), ('INS', []), ('DEL', [])]),
+                       record_file, variant_file_name(record_file))
+        file_names.append(record_file)
+    return file_names
+
+
+def find_clean_cuts(genome, start, end):
+    """
+    :param genome: genome sequence
+    :return: for every position from start to end, whether no periodic stretch of any STR length reaches across it -
+             the STRs on either side of such a cut only depend on the bases on their side, and the genome length
+             is a position too
+    """
+    sequence = as_byte_array(genome)
+    clean = np.ones(end - start, dtype=bool)
+    first = max(0, start - 6)
+    window = sequence[first:min(len(sequence), end + 5)]
+
+    for STR_LENGTH in xrange(2, 6):
+        # stretches ending within STR_LENGTH + 1 bases before a cut still read the bases after it
+        same = np.zeros(len(window) + STR_LENGTH + 2, dtype=np.int64)
+        same[STR_LENGTH + 2:STR_LENGTH + 2 + len(window) - STR_LENGTH] = window[:-STR_LENGTH] == window[STR_LENGTH:]
+        before = np.cumsum(same)
+        cuts = np.arange(start, end) - first + STR_LENGTH + 1  # index of the comparison just before each cut
+        clean &= before[cuts] - before[cuts - STR_LENGTH - 1] == 0
+
+    clean[np.arange(start, end) == 0] = True
+    clean[np.arange(start, end) == len(sequence)] = True
+    return clean
+
+
+def find_clean_cut_positions(genome, window=STR_WINDOW):
+    """
+    :return: sorted positions of every clean cut of the genome, checked window bases at a time
+    """
+    positions = [np.flatnonzero(find_clean_cuts(genome, start, min(len(genome) + 1, start + window))) + start
+                 for start in xrange(0, len(genome) + 1, window)]
+    return np.concatenate(positions)
+
+
+def tandem_repeat_hits(tandem_repeats):
+    """
+    :param tandem_repeats: STRs as get_genome_tandem_repeats finds them
+    :return: (STR, start-index, repeats) of every STR
+    """
+    return [(STR, index, repeats) for STR in tandem_repeats for index, repeats in tandem_repeats[STR]]
+
+
+def hits_to_tandem_repeats(hits):
+    """
+    :param hits: (STR, start-index, repeats) of every STR in any order
+    :return: STRs built in the order of a full scan - by length, then position - so they process the same way
+    """
+    tandem_repeats = defaultdict(list)
+    for STR, index, repeats in sorted(hits, key=lambda hit: (len(hit[0]), hit[1], hit[0])):
+        tandem_repeats[STR].append((index, repeats))
+    return tandem_repeats
+
+
+def scan_windows_tandem_repeats(genome, starts, ends):
+    """
+    :param genome: genome sequence - every window should start and end at a clean cut
+    :param starts: first position of every window
+    :param ends: position after every window
+    :return: (STR, start-index, repeats) of every STR in the windows, found by one scan of the windows joined
+             by separators that never repeat
+    """
+    windows = []
+    window_starts = np.zeros(len(starts), dtype=np.int64)  # position of each window in the joined sequence
+    offset = 0
+    for i, (start, end) in enumerate(zip(starts, ends)):
+        windows.append(genome[start:end])
+        window_starts[i] = offset
+        offset += end - start + len(WINDOW_SEPARATOR)
+    joined = WINDOW_SEPARATOR.join(windows)
+
+    hits = []
+    for STR_LENGTH in xrange(2, 6):
+        hits.extend(merge_rotations(scan_tandem_repeats(joined, STR_LENGTH)))
+    if not hits:
+        return hits
+
+    # move every hit from the joined sequence back to the genome
+    indices = np.array([hit[1] for hit in hits], dtype=np.int64)
+    windows = np.searchsorted(window_starts, indices, side='right') - 1
+    indices += np.asarray(starts, dtype=np.int64)[windows] - window_starts[windows]
+    return [(STR, index, repeats) for (STR, _, repeats), index in zip(hits, indices.tolist())]
@@ -1,8 +1,13 @@
-import os
-import cPickle
-import textwrap
 import itertools
+import instrumentation
+import mate_rescue
 from helpers import *
+from kmer_index import *
+from stage_cache import *
+from parallel_helpers import *
+from donor_assembly import *
+from pileup import Pileup, VariationTally
+from mate_rescue import InsertSizeModel
 from smith_waterman_align import *
 from collections import defaultdict
 import numpy as np
@@ -12,38 +17,68 @@ logger.basicConfig(level=logger.INFO,format='> %(message)s')
 READ_LENGTH = 50
 SNP_THRESHOLD = 5
 KEY_LENGTH = 5
+MAX_SEED_HITS = 1000  # parts of a read found more often in the reference are not used as seeds
+INDEL_SHARD_SIZE = 1000  # unmapped reads aligned by a worker at once
+RESCUE_PADDING = 10  # bases added on both sides of a rescue window for indel checks
+STR_MARGIN = 16  # bases on both sides of a variant rescanned for STRs, before widening to clean cuts
 SNPS = []
 INSERTIONS = []
 DELETIONS = []
-VARIATIONS = defaultdict()
+VARIATIONS = Pileup()
 
 
-def created_hashed_map(reference, hash_file_path):
+def created_hashed_map(reference, cache_folder, index_key):
     """
     :param reference: reference genome
-    :param hash_file_path: location of hashtable
-    :return: hashed reference genome
-    """
-    if os.path.exists(hash_file_path):
-        logger.info("Loading hashed file from location {}".format(hash_file_path))
-        hashed_reference = cPickle.load(open(hash_file_path, 'rb'))  # load from hard-disk
-    else:
-        logger.info("Creating hashed file from reference")
+    :param cache_folder: location of the stage cache
+    :param index_key: stage key of the index, from the reference contents and the k-mer length
+    :return: k-mer index of the reference genome
+    """
+    cached = load_stage(cache_folder, 'index', index_key)
+    if cached is not None:
+        logger.info("Loading hashed reference from the cache")
+        return KmerIndex(READ_LENGTH / KEY_LENGTH, cached['offsets'], cached['positions'])
+
+    logger.info("Creating hashed file from reference")
+    with instrumentation.stage('index') as record:
+        record.items = len(reference)
         hash_size = READ_LENGTH / KEY_LENGTH
-        hashed_reference = defaultdict(list)
-
-        for i in range(len(reference) - hash_size):
-            if i % 100000 == 0:
-                logger.info("Creating Hashed Reference Map. Completed {} %".format(
-                    str(100 * i / float(len(reference) - hash_size))[:5]))
-            hashed_reference[reference[i: i + hash_size]].append(i)
+        hashed_reference = build_kmer_index(reference, hash_size)
 
-        logger.info("Dumping hashed file at {}".format(hash_file_path))
-        cPickle.dump(hashed_reference, open(hash_file_path, "wb"))  # dump on hard-disk
+    logger.info("Caching hashed reference")
+    store_stage(cache_folder, 'index', index_key,
+                {'offsets': hashed_reference.offsets, 'positions': hashed_reference.positions})
 
     return hashed_reference
 
 
+def get_index_key(reference, reference_file_path, cache_folder=None):
+    """
+    :param cache_folder: location of the stage cache, which keeps the digest of the reference file
+    :return: stage key of the index, from the reference contents and the k-mer length
+    """
+    return stage_key('index', [reference_file_path], {'record': reference.name, 'k': READ_LENGTH / KEY_LENGTH},
+                     cache_folder=cache_folder)
+
+
+def get_stage_keys(reference, reference_file_path, reads_file_path, cache_folder=None):
+    """
+    :param cache_folder: location of the stage cache, which keeps the digests of the input files
+    :return: stage keys of the index, SNPs and INDELs - a stage reruns only when its inputs, its parameters
+             or a stage it reads change
+    """
+    index_key = get_index_key(reference, reference_file_path, cache_folder)
+    # KEY_LENGTH also sets the mismatches a read may have, not only the k of the index
+    params = {'SNP_THRESHOLD': SNP_THRESHOLD, 'READ_LENGTH': READ_LENGTH, 'KEY_LENGTH': KEY_LENGTH,
+              'MAX_SEED_HITS': MAX_SEED_HITS, 'RESCUE_PADDING': RESCUE_PADDING}
+    for name in ('MIN_PAIRS', 'MAX_INSERT', 'RESCUE_DEVIATIONS', 'MIN_SLACK', 'DEFAULT_SLACK'):
+        params[name] = getattr(mate_rescue, name)  # the rescue window decides which mates stay unmapped
+    snp_key = stage_key('snps', [reads_file_path], params, [index_key], cache_folder)
+    indel_key = stage_key('indels', depends=[snp_key])
+
+    return index_key, snp_key, indel_key
+
+
 def match_read_with_reference(reference, read, start_ref_pos, end_ref_pos):
     """
     :return: get all variations between read and part of reference
@@ -57,35 +92,214 @@ def match_read_with_reference(reference, read, start_ref_pos, end_ref_pos):
     return small_variations
 
 
-def map_read_to_reference(read, hashed_reference_map, reference):
+def verify_candidates(read, start_positions, reference):
+    """
+    :param start_positions: candidate start locations of the read in the reference
+    :return: first candidate with at most KEY_LENGTH - 1 mismatches and its variations, None if there is none
+    """
+    reference_bases = as_byte_array(reference)
+    read_bases = np.frombuffer(read, dtype=np.uint8)
+    starts = np.asarray(start_positions, dtype=np.int64)
+    starts = starts[(starts >= 0) & (starts + len(read) <= len(reference_bases))]
+    instrumentation.count('candidates_verified', len(starts))
+
+    # count mismatches one part of the read at a time, dropping candidates as soon as they have too many
+    mismatches = np.zeros(len(starts), dtype=np.int64)
+    candidates = np.arange(len(starts))
+    part_length = max(1, len(read) / KEY_LENGTH)
+    for part_start in xrange(0, len(read), part_length):
+        if not len(candidates):
+            return None
+        columns = np.arange(part_start, min(len(read), part_start + part_length))
+        window = reference_bases[starts[candidates][:, None] + columns]
+        mismatches[candidates] += (window != read_bases[columns]).sum(axis=1)
+        candidates = candidates[mismatches[candidates] <= KEY_LENGTH - 1]
+
+    if not len(candidates):
+        return None
+    start_ref_pos = int(starts[candidates[0]])
+    return start_ref_pos, match_read_with_reference(reference, read, start_ref_pos, start_ref_pos + len(read))
+
+
+def map_read_to_reference(read, hashed_reference_map, reference, variations=VARIATIONS, seed_ranges=None):
+    """
+    :param seed_ranges: index ranges of the read's seeds, from get_seed_ranges - looked up if not given
+    :return: start location of read in the reference and whether its reverse complement matched,
+             None if cannot find location
+    """
+    starts, reverse = vote_candidates(read, hashed_reference_map, seed_ranges)
+    rank = np.arange(len(starts))
+
+    # both strands were voted on together - keep the accepted candidate with the best rank
+    best = None
+    for strand, strand_read in ((False, read), (True, reverse_complement(read))):
+        on_strand = reverse == strand
+        if best is not None:
+            on_strand &= rank < best[0]
+        match = verify_candidates(strand_read, starts[on_strand], reference)
+        if match is not None:
+            start_ref_pos, score = match
+            best = (rank[on_strand][starts[on_strand] == start_ref_pos][0], start_ref_pos, strand, score)
+
+    if best is None:
+        return None
+    _, start_ref_pos, strand, score = best
+    add_variations(score, variations)
+    return start_ref_pos, strand
+
+
+def get_seed_ranges(reads, hashed_reference_map):
     """
-    :return: start location of read in the reference else false if cannot find location
+    :param reads: reads of equal length
+    :return: first and last index in the index positions of every part of every read and of its reverse complement,
+             each of shape (reads, 2, parts) - the parts of the whole batch are encoded and looked up at once
     """
-    read_hash = textwrap.wrap(read, len(read) / KEY_LENGTH)
-    for i, part_read in enumerate(read_hash):
-        if hashed_reference_map.has_key(part_read):
-            for positions in hashed_reference_map[part_read]:
-                start_ref_pos = positions - (i * (len(read) / KEY_LENGTH))
-                end_ref_pos = min(len(reference), start_ref_pos + len(read))
-                score = match_read_with_reference(reference, read, start_ref_pos, end_ref_pos)
-                if len(score) <= KEY_LENGTH - 1:
-                    add_variations(score)
-                    return start_ref_pos
+    part_length = len(reads[0]) / KEY_LENGTH if reads else 0
+    if part_length != hashed_reference_map.k:  # parts of another length are never in the index
+        empty = np.zeros((len(reads), 2, 0), dtype=np.int64)
+        return empty, empty
+    return hashed_reference_map.seed_ranges(*encode_seeds(reads, part_length, len(reads[0]) / part_length))
 
+
+def vote_candidates(read, hashed_reference_map, seed_ranges=None):
+    """
+    :param seed_ranges: index ranges of the read's seeds, from get_seed_ranges - looked up if not given
+    :return: candidate start locations of the read or its reverse complement, most voted by their parts first,
+             and whether each one is for the reverse complement
+    """
+    if seed_ranges is None:
+        seed_ranges = [ranges[0] for ranges in get_seed_ranges([read], hashed_reference_map)]
+
+    # parts of both strands, rarest first - parts seen more than MAX_SEED_HITS times are skipped
+    part_length = len(read) / KEY_LENGTH
+    first, last = seed_ranges
+    counts = (last - first).tolist()
+    first = first.tolist()
+    seeds = []
+    for strand in (0, 1):
+        for i, count in enumerate(counts[strand]):
+            if count:
+                seeds.append((count, strand, i, first[strand][i]))
+    seeds.sort(key=itemgetter(0, 1, 2))
+
+    # candidates of both strands share one key - start location * 2 + strand
+    positions = hashed_reference_map.positions
+    candidates = [(positions[start:start + count].astype(np.int64) - i * part_length) * 2 + strand
+                  for count, strand, i, start in seeds if count <= MAX_SEED_HITS]
+    if not candidates and seeds:  # every part is repetitive - only try the first hits of the rarest one
+        count, strand, i, start = seeds[0]
+        candidates = [(positions[start:start + min(count, MAX_SEED_HITS)].astype(np.int64) - i * part_length) * 2 +
+                      strand]
+    instrumentation.count('seeds_tried', len(seeds))  # valid parts found in the index
+    instrumentation.count('seeds_used', len(candidates))
+    if not candidates:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=bool)
+
+    # with at most KEY_LENGTH - 1 mismatches one of the KEY_LENGTH parts matches exactly (pigeonhole),
+    # so a true location gets at least one vote and usually one from every exact part
+    keys, votes = np.unique(np.concatenate(candidates), return_counts=True)
+    keys = keys[np.lexsort((keys, -votes))]
+    return keys >> 1, (keys & 1).astype(bool)
+
+
+def map_read_pair(read, hashed_reference_map, reference, half_mapped_reads, variations=VARIATIONS,
+                  insert_sizes=None, seed_ranges=(None, None)):
+    """
+    :param seed_ranges: index ranges of the seeds of both ends, from get_seed_ranges - looked up if not given
+    :return: map both ends of a paired-end read - learn the insert size from pairs that map on opposite
+             strands, keep the other end of a half-mapped read for mate rescue
+    """
+    if len(read[0]) != READ_LENGTH or len(read[1]) != READ_LENGTH:
+        return
+
+    check_read_1 = map_read_to_reference(read[0], hashed_reference_map, reference, variations,
+                                         seed_ranges[0])  # map read
+    check_read_2 = map_read_to_reference(read[1], hashed_reference_map, reference, variations, seed_ranges[1])
+
+    if check_read_1 is not None and check_read_2 is not None:
+        if insert_sizes is not None and check_read_1[1] != check_read_2[1]:
+            forward, reverse = (check_read_2, check_read_1) if check_read_1[1] else (check_read_1, check_read_2)
+            insert_sizes.add(forward[0], reverse[0], READ_LENGTH)
+
+    # only one of them is matched
+    elif check_read_1 is not None or check_read_2 is not None:
+        if check_read_1 is not None:
+            check_position, reverse = check_read_1
+            mate = read[1]
+        else:
+            check_position, reverse = check_read_2
+            mate = read[0]
+
+        # the ends of a pair lie on opposite strands - keep the mate as it appears in the reference
+        recheck_read = mate if reverse else reverse_complement(mate)
+        half_mapped_reads.append([recheck_read, check_position, reverse])
+
+
+def rescue_mate(half_mapped, reference, insert_sizes, unmapped_reads, variations=VARIATIONS):
+    """
+    :param half_mapped: [mate, start of the mapped end, whether the mapped end is reverse complement]
+    :return: place the mate by mismatches in its expected window, else queue it for indel checks in that window
+    """
+    mate, check_position, reverse = half_mapped
+    start_ref, end_ref = insert_sizes.window(check_position, reverse, len(mate))
+
+    match = verify_candidates(mate, np.arange(start_ref, end_ref - len(mate) + 1), reference)
+    if match is not None:
+        add_variations(match[1], variations)
+        return True
+
+    unmapped_reads.append([mate, max(0, start_ref - RESCUE_PADDING), end_ref + RESCUE_PADDING])
     return False
 
 
-def add_variations(scores):
+def rescue_mate_shard(half_mapped_reads):
+    """
+    :param half_mapped_reads: shard of half-mapped reads - rescued against SHARED reference and insert sizes
+    :return: variations of the rescued mates and the mates left for indel checks
+    """
+    variations = VariationTally()
+    unmapped_reads = []
+    for half_mapped in half_mapped_reads:
+        rescue_mate(half_mapped, SHARED['reference'], SHARED['insert_sizes'], unmapped_reads, variations)
+
+    return variations, unmapped_reads
+
+
+def map_read_batch(job):
+    """
+    :param job: (progress, batch of paired-end reads) from read_pairs_in_batches
+    :return: progress, batch size, variations, half-mapped reads and insert sizes of the batch -
+             mapped against SHARED reference
+    """
+    progress, batch = job
+    variations = VariationTally()
+    half_mapped_reads = []
+    insert_sizes = InsertSizeModel()
+    hashed_reference_map = SHARED['hashed_reference_map']
+
+    # seeds of every end in the batch at once - ends of another length are not mapped
+    pairs = [read for read in batch if len(read[0]) == READ_LENGTH and len(read[1]) == READ_LENGTH]
+    first, last = get_seed_ranges([end for read in pairs for end in read], hashed_reference_map)
+    for n, read in enumerate(pairs):
+        map_read_pair(read, hashed_reference_map, SHARED['reference'], half_mapped_reads, variations, insert_sizes,
+                      ((first[2 * n], last[2 * n]), (first[2 * n + 1], last[2 * n + 1])))
+
+    return progress, len(batch), variations, half_mapped_reads, insert_sizes
+
+
+def add_variations(scores, variations=VARIATIONS):
     """
     :return: add all variations at specific position
     """
-    for score in scores:
-        if VARIATIONS.has_key(score[0]):
-            temp = VARIATIONS[score[0]]
-            temp.append(score[1])
-            VARIATIONS[score[0]] = temp
-        else:
-            VARIATIONS[score[0]] = [score[1]]
+    variations.add([score[0] for score in scores], [score[1] for score in scores])
+
+
+def merge_variations(variations):
+    """
+    :param variations: variations tallied by a worker
+    :return: add them to all variations
+    """
+    VARIATIONS.merge(variations)
 
 
 def get_snps(reference):
@@ -93,65 +307,145 @@ def get_snps(reference):
     :return: all SNPS that have coverage greater than threshold
     """
     logger.info("Finding SNPs using variations")
-    for key in VARIATIONS:
-        snp = max(VARIATIONS[key], key=VARIATIONS[key].count)
-        if VARIATIONS[key].count(snp) >= SNP_THRESHOLD:
-            SNPS.append([reference[key], snp, key])
+    with instrumentation.stage('snp_calling') as record:
+        positions, bases = VARIATIONS.call(SNP_THRESHOLD)
+        for key, snp in zip(positions.tolist(), bases.tolist()):
+            SNPS.append([reference[key], 'ACGT'[snp], key])
+        record.items = len(positions)
     return SNPS
 
 
-def get_tandem_repeats(donor):
+def get_tandem_repeats(donor, workers=WORKERS):
     """
     :return: STRs in the donor sequence
     """
     logger.info("Getting Short Tandem Repeats")
-    tandem_repeats = get_reference_tandem_repeats(''.join(donor))  # get short tandem repeats
+    tandem_repeats = get_genome_tandem_repeats([str(donor)], workers)[0]  # get short tandem repeats
     STRs = preprocess_tandems(tandem_repeats)  # pre-process tandem repeats
 
     return STRs
 
 
+def variant_windows(reference, clean_cuts, SNPs, INDELs):
+    """
+    :param clean_cuts: sorted clean cuts of the reference
+    :return: starts and ends of reference windows around every SNP and INDEL, widened to clean cuts
+             and merged where they overlap
+    """
+    spans = [(int(snp[2]), int(snp[2]) + 1) for snp in SNPs]
+    spans += [(int(dels[1]), int(dels[1]) + len(dels[0])) for dels in INDELs[0]]
+    spans += [(int(ins[1]), int(ins[1])) for ins in INDELs[1]]
+    if not spans:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    spans = np.array(sorted(spans), dtype=np.int64)
+    starts = clean_cuts[np.searchsorted(clean_cuts, np.maximum(0, spans[:, 0] - STR_MARGIN), side='right') - 1]
+    ends = clean_cuts[np.searchsorted(clean_cuts, np.minimum(len(reference), spans[:, 1] + STR_MARGIN))]
+
+    # windows that touch share the bases next to their cut, so they are merged too
+    ends = np.maximum.accumulate(ends)
+    first = np.concatenate(([True], starts[1:] > ends[:-1]))
+    last = np.concatenate((first[1:], [True]))
+    return starts[first], ends[last]
+
+
+def get_incremental_tandem_repeats(reference, catalogue, donor, donor_assembly, SNPs, INDELs):
+    """
+    :param catalogue: STR catalogue holding the reference record, from str_catalogue.get_str_catalogue
+    :return: STRs in the donor sequence as get_tandem_repeats finds them - only the windows around the variants
+             are rescanned, every other STR is the reference STR moved to its donor position
+    """
+    logger.info("Getting Short Tandem Repeats around {} variants".format(
+        len(SNPs) + len(INDELs[0]) + len(INDELs[1])))
+    reference_hits = catalogue.record_hits(reference.name)
+    clean_cuts = catalogue.record_clean_cuts(reference.name)
+    starts, ends = variant_windows(reference, clean_cuts, SNPs, INDELs)
+
+    with instrumentation.stage('str_rescan') as record:
+        # reference STRs start either inside a window or clear of every window
+        indices = np.array([hit[1] for hit in reference_hits], dtype=np.int64)
+        window = np.searchsorted(starts, indices, side='right') - 1
+        rescanned = (window >= 0) & (indices < ends[np.maximum(window, 0)]) if len(starts) else \
+            np.zeros(len(indices), dtype=bool)
+        donor_indices = donor_assembly.reference_to_donor_batch(indices)
+        hits = [(STR, index, repeats) for (STR, _, repeats), index, inside in
+                zip(reference_hits, donor_indices.tolist(), rescanned.tolist()) if not inside]
+
+        # the ends of the reference map to the ends of the donor, taking insertions at either end along
+        donor_starts = np.where(starts == 0, 0, donor_assembly.reference_to_donor_batch(starts))
+        donor_ends = np.where(ends == len(reference), len(donor), donor_assembly.reference_to_donor_batch(ends))
+        hits.extend(scan_windows_tandem_repeats(donor, donor_starts, donor_ends))
+        record.items = int((donor_ends - donor_starts).sum())
+
+    logger.info("Rescanned {} windows of {} bases".format(len(starts), record.items))
+    return preprocess_tandems(hits_to_tandem_repeats(hits))
+
+
 def check_for_indels(recheck_read, reference, start_ref, end_ref):
     """
     :return: insertions and deletions between read and reference
     """
     align_seq_1, align_seq_2 = waterman_algorithm(reference[start_ref:end_ref], recheck_read)
+    add_alignment_indels(align_seq_1, align_seq_2, start_ref, reference[start_ref:end_ref])
+
+
+def check_batch_for_indels(unmapped_reads, reference):
+    """
+    :param unmapped_reads: [read, start_ref, end_ref] of reads to align against their reference window
+    :return: insertions and deletions between the reads and reference, aligned in one call
+    """
+    windows = [reference[unmapped[1]:unmapped[2]] for unmapped in unmapped_reads]
+    alignments = waterman_algorithm_batch([(window, unmapped[0]) for window, unmapped in zip(windows, unmapped_reads)])
 
+    for (align_seq_1, align_seq_2), window, unmapped in zip(alignments, windows, unmapped_reads):
+        add_alignment_indels(align_seq_1, align_seq_2, unmapped[1], window)
+
+
+def check_indel_shard(unmapped_reads):
+    """
+    :param unmapped_reads: shard of unmapped reads - aligned against SHARED reference
+    :return: insertions and deletions found in the shard
+    """
+    first_insertion, first_deletion = len(INSERTIONS), len(DELETIONS)
+    check_batch_for_indels(unmapped_reads, SHARED['reference'])
+
+    insertions, deletions = INSERTIONS[first_insertion:], DELETIONS[first_deletion:]
+    del INSERTIONS[first_insertion:], DELETIONS[first_deletion:]
+
+    return insertions, deletions
+
+
+def merge_indels(insertions, deletions):
+    """
+    :return: add insertions and deletions found by a worker to all indels
+    """
+    INSERTIONS.extend(insertions)
+    DELETIONS.extend(deletions)
+
+
+def add_alignment_indels(align_seq_1, align_seq_2, start_ref, check_ref):
+    """
+    :return: record the insertion or deletion an alignment shows
+    """
     if bool(align_seq_1) and bool(align_seq_2):
         if "-" in align_seq_1 and '-' not in align_seq_2:
-            check_for_insertions(align_seq_1, align_seq_2, start_ref, reference[start_ref:end_ref])
+            check_for_insertions(align_seq_1, align_seq_2, start_ref, check_ref)
         elif '-' in align_seq_2 and '-' not in align_seq_1:
-            check_for_deletions(align_seq_1, align_seq_2, start_ref, reference[start_ref:end_ref])
+            check_for_deletions(align_seq_1, align_seq_2, start_ref, check_ref)
 
 
 def create_donor_sequence(reference, SNPs, INDELs):
     """
-    :return: donor sequence and corresponding location in reference
+    :return: donor sequence and the assembly translating donor and reference locations
     """
     logger.info("Reassembling Donor Sequence")
-    donor = list(reference)
-    reference_location = np.arange(1, len(reference))
-
-    # change SNPs in the donor sequence
-    logger.info("Modifying SNPs")
-    for s in SNPs:
-        donor[int(s[2])] = s[1]
+    with instrumentation.stage('donor_assembly') as record:
+        donor_assembly = DonorAssembly(reference, SNPs, INDELs[1], INDELs[0])
+        donor = donor_assembly.sequence()
+        record.items = len(donor)
+    logger.info("Donor assembled from {} reference segments and insertions".format(len(donor_assembly.lengths)))
 
-    # insertions
-    for count, ins in enumerate(INDELs[1]):
-        reference_location[int(ins[1]):] = np.add(reference_location[int(ins[1]):],
-                                                  (len(reference_location) - int(ins[1])) * [len(ins[0])])
-        donor.insert(int(ins[1]), ins[0])
-
-    # deletions
-    # reducing accuracy :'( by 5 points
-    for dels in INDELs[0]:
-        delete_location = reference_location[dels[1]] - 1
-        reference_location[dels[1]:] = np.subtract(reference_location[dels[1]:],
-                                                   (len(reference_location) - dels[1]) * [len(dels[0])])
-        del donor[delete_location:delete_location + len(dels[0])]
-
-    return donor, reference_location
+    return donor, donor_assembly
 
 
 def process_snps(snps):
@@ -194,29 +488,17 @@ def process_indels(indel):
     return processed_indels
 
 
-def find_reference_position(STRs, reference_location):
+def find_reference_position(STRs, donor_assembly):
     """
-    :return: real STR position in reference
+    :return: real STR position in reference - the reference position of the STR's first base, or for an STR
+             starting on inserted bases the reference position the insertion goes before, as INS records give it
     """
-    processed_STRs = []
-    reference_location = reference_location.tolist()
-    reference_location_set = set(reference_location)
-    for STR in STRs:
-        if STR[1] in reference_location_set:
-            new_location = reference_location.index(STR[1])
-        # messed up the index
-        elif STR[1] + 1 in reference_location_set:
-            new_location = reference_location.index(STR[1] + 1)
-        # messed up the index
-        elif STR[1] - 1 in reference_location_set:
-            new_location = reference_location.index(STR[1] - 1)
-        # just omit the STRs - better than finding their approximate location
-        else:
-            continue
-
-        processed_STRs.append([STR[0],new_location])
+    donor_locations = np.array([STR[1] for STR in STRs], dtype=np.int64)
+    reference_locations = donor_assembly.donor_to_reference_batch(donor_locations, insertion_sites=True)
 
-    return processed_STRs
+    # STRs outside the donor have no position
+    return [[STR[0], new_location] for STR, new_location in zip(STRs, reference_locations.tolist())
+            if new_location >= 0]
 
 
 def add_insertions(start_pos, insert_string):
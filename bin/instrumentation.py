@@ -0,0 +1,129 @@
+import os
+import json
+import time
+import resource
+from collections import defaultdict
+from contextlib import contextmanager
+
+STAGES = []  # measurements of each stage run, in the order they completed
+COUNTERS = defaultdict(int)  # hot-path events - seeds tried and used, candidates verified, dp cells filled
+
+
+class StageRecord(object):
+    """
+    Measurements of one run of a pipeline stage.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.runs = 1
+        self.items = 0  # reads, alignments or bases the stage processed
+        self.wall_time = 0.0
+        self.cpu_time = 0.0
+        self.peak_rss = 0
+
+    def merge(self, other):
+        """
+        :return: add another run of the same stage
+        """
+        self.runs += other.runs
+        self.items += other.items
+        self.wall_time += other.wall_time
+        self.cpu_time += other.cpu_time
+        self.peak_rss = max(self.peak_rss, other.peak_rss)
+
+    def as_dict(self):
+        return {'stage': self.name,
+                'runs': self.runs,
+                'items': self.items,
+                'wall_secs': round(self.wall_time, 6),
+                'cpu_secs': round(self.cpu_time, 6),
+                'peak_rss_mb': round(self.peak_rss / 1024.0, 3),
+                'items_per_sec': round(self.items / self.wall_time, 3) if self.wall_time > 0 else 0.0}
+
+
+def cpu_time():
+    """
+    :return: user and system time of this process and of its finished workers
+    """
+    own, workers = resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + workers.ru_utime + workers.ru_stime
+
+
+def peak_rss():
+    """
+    :return: largest resident set in kilobytes so far, of this process or of any finished worker
+    """
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+
+@contextmanager
+def stage(name):
+    """
+    :param name: name of the pipeline stage
+    :return: record of the stage, whose items the stage sets - timed and added to STAGES on exit
+    """
+    record = StageRecord(name)
+    wall, cpu = time.time(), cpu_time()
+    try:
+        yield record
+    finally:
+        record.wall_time = time.time() - wall
+        record.cpu_time = cpu_time() - cpu
+        record.peak_rss = peak_rss()
+        STAGES.append(record)
+
+
+def count(event, amount=1):
+    COUNTERS[event] += amount
+
+
+def merge_counters(counters):
+    """
+    :return: add the counters of a worker
+    """
+    for event, amount in counters.iteritems():
+        COUNTERS[event] += amount
+
+
+def reset():
+    del STAGES[:]
+    COUNTERS.clear()
+
+
+def report():
+    """
+    :return: measurements of every stage, runs of the same stage added up in the order stages first ran,
+             and the hot-path counters
+    """
+    stages = []
+    by_name = {}
+    for record in STAGES:
+        if record.name not in by_name:
+            by_name[record.name] = StageRecord(record.name)
+            by_name[record.name].runs = 0
+            stages.append(by_name[record.name])
+        by_name[record.name].merge(record)
+
+    return {'stages': [record.as_dict() for record in stages],
+            'counters': dict(COUNTERS),
+            'total': {'wall_secs': round(sum(record.wall_time for record in STAGES), 6),
+                      'cpu_secs': round(sum(record.cpu_time for record in STAGES), 6),
+                      'peak_rss_mb': round(peak_rss() / 1024.0, 3)}}
+
+
+def write_report(report_file_name):
+    """
+    :return: writes the report as JSON
+    """
+    with open(report_file_name, 'w') as f:
+        json.dump(report(), f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def report_file_name(file_name):
+    """
+    :return: location of the report that goes with an output file
+    """
+    return os.path.splitext(file_name)[0] + ".report.json"
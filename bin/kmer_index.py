@@ -0,0 +1,137 @@
+import numpy as np
+import logging as logger
+from reference import as_byte_array
+
+logger.basicConfig(level=logger.INFO, format='> %(message)s')
+
+INVALID_BASE = 4  # code of every character that is not A, C, G or T
+MAX_KMER_LENGTH = 13  # longest k-mer indexed - offsets take 8 * 4 ** k bytes, 512 MB at 13, and codes fit uint32
+BASE_CODES = np.full(256, INVALID_BASE, dtype=np.uint8)  # ascii -> 2-bit base code
+for code, base in enumerate('ACGT'):
+    BASE_CODES[ord(base)] = code
+    BASE_CODES[ord(base.lower())] = code
+
+
+def encode_bases(sequence):
+    """
+    :param sequence: DNA sequence (Reference, string or uint8 array of ascii characters)
+    :return: 2-bit code of every base, INVALID_BASE for anything else
+    """
+    return BASE_CODES[as_byte_array(sequence)]
+
+
+def encode_kmers(codes, k):
+    """
+    :param codes: 2-bit base codes of a sequence
+    :param k: length of the k-mers
+    :return: integer code of the k-mer starting at every position and whether it holds only valid bases
+    """
+    count = len(codes) - k + 1
+    if count <= 0:
+        return np.zeros(0, dtype=np.uint32), np.zeros(0, dtype=bool)
+
+    kmers = np.zeros(count, dtype=np.uint32)
+    for i in xrange(k):
+        kmers <<= 2
+        kmers |= codes[i:i + count] & 3
+
+    invalid = np.concatenate(([0], np.cumsum(codes == INVALID_BASE)))
+    valid = invalid[k:] == invalid[:count]
+
+    return kmers, valid
+
+
+def encode_seeds(reads, part_length, parts):
+    """
+    :param reads: reads of equal length
+    :param part_length: length of each seed
+    :param parts: seeds taken from the start of each read, one after another
+    :return: integer code of every seed of every read and of its reverse complement - shape (reads, 2, parts) -
+             and whether each seed holds only valid bases
+    """
+    if not reads:
+        return np.zeros((0, 2, parts), dtype=np.uint32), np.zeros((0, 2, parts), dtype=bool)
+
+    codes = encode_bases(''.join(reads)).reshape(len(reads), -1)
+    complement = np.where(codes == INVALID_BASE, INVALID_BASE, 3 - codes).astype(np.uint8)[:, ::-1]
+    strands = np.stack((codes, complement), axis=1)[:, :, :parts * part_length]
+    strands = strands.reshape(len(reads), 2, parts, part_length)
+
+    seeds = np.zeros((len(reads), 2, parts), dtype=np.uint32)
+    for i in xrange(part_length):
+        seeds <<= 2
+        seeds |= strands[:, :, :, i] & 3
+
+    return seeds, (strands != INVALID_BASE).all(axis=3)
+
+
+class KmerIndex(object):
+    """
+    Every position of each k-mer in the reference, stored as two flat arrays:
+    positions sorted by k-mer code and the offset of each code's block in positions.
+    """
+
+    def __init__(self, k, offsets, positions):
+        self.k = k
+        self.offsets = offsets
+        self.positions = positions
+
+    def code(self, kmer):
+        """
+        :return: integer code of the k-mer, None if it is not a valid k-mer
+        """
+        if len(kmer) != self.k:
+            return None
+        code = 0
+        for base in kmer:
+            base = BASE_CODES[ord(base)]
+            if base == INVALID_BASE:
+                return None
+            code = (code << 2) | int(base)
+        return code
+
+    def lookup(self, kmer):
+        """
+        :return: reference positions of the k-mer in increasing order
+        """
+        code = self.code(kmer)
+        if code is None:
+            return self.positions[:0]
+        return self.positions[self.offsets[code]:self.offsets[code + 1]]
+
+    def seed_ranges(self, seeds, valid):
+        """
+        :param seeds: integer codes of k-mers, from encode_seeds
+        :param valid: whether each code is of a valid k-mer
+        :return: first and last index in positions of every seed - codes index the offsets directly,
+                 so a whole batch is looked up at once
+        """
+        first = self.offsets[seeds]
+        last = np.where(valid, self.offsets[seeds.astype(np.int64) + 1], first)
+        return first, last
+
+    def count(self, kmer):
+        """
+        :return: number of occurrences of the k-mer in the reference
+        """
+        return len(self.lookup(kmer))
+
+
+def build_kmer_index(reference, k):
+    """
+    :param reference: reference genome
+    :param k: length of the k-mers
+    :return: k-mer index of the reference
+    """
+    if not 1 <= k <= MAX_KMER_LENGTH:
+        raise ValueError("k-mer length {} is not between 1 and {}".format(k, MAX_KMER_LENGTH))
+    kmers, valid = encode_kmers(encode_bases(reference), k)
+    positions = np.flatnonzero(valid).astype(np.uint32)
+    kmers = kmers[valid]
+
+    order = np.argsort(kmers, kind='mergesort')  # stable - positions of a k-mer stay sorted
+    positions = positions[order]
+    offsets = np.zeros(4 ** k + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(kmers, minlength=4 ** k))
+
+    return KmerIndex(k, offsets, positions)
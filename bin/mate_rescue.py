@@ -0,0 +1,64 @@
+import math
+
+MIN_PAIRS = 100  # confidently mapped pairs needed before the learned window is used
+MAX_INSERT = 2000  # longest distance between the ends of a pair taken as confidently mapped
+RESCUE_DEVIATIONS = 4  # standard deviations of insert size searched on both sides of the expected mate start
+MIN_SLACK = 10  # smallest search distance on each side of the expected mate start
+DEFAULT_SLACK = 200  # search distance on each side of the mapped end until the insert size is learned
+
+
+class InsertSizeModel(object):
+    """
+    Running mean and standard deviation of the insert size - the distance from the start of the forward end
+    to the end of the reverse end - of pairs whose both ends mapped on opposite strands.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.total_squares = 0.0
+
+    def add(self, forward_start, reverse_start, read_length):
+        """
+        :return: record the insert size of a pair, ignoring pairs that are too far apart to be confident
+        """
+        insert_size = reverse_start + read_length - forward_start
+        if 0 < insert_size <= MAX_INSERT:
+            self.count += 1
+            self.total += insert_size
+            self.total_squares += insert_size * insert_size
+
+    def merge(self, other):
+        """
+        :return: add the pairs seen by another model
+        """
+        self.count += other.count
+        self.total += other.total
+        self.total_squares += other.total_squares
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def deviation(self):
+        if not self.count:
+            return 0.0
+        return math.sqrt(max(0.0, self.total_squares / self.count - self.mean() ** 2))
+
+    def window(self, position, reverse, read_length):
+        """
+        :param position: start of the mapped end of the pair
+        :param reverse: whether the mapped end matched as reverse complement
+        :param read_length: length of the mate
+        :return: start and end of the reference window where the mate is expected
+        """
+        if self.count < MIN_PAIRS:
+            return position - DEFAULT_SLACK, position + DEFAULT_SLACK
+
+        slack = int(max(MIN_SLACK, RESCUE_DEVIATIONS * self.deviation()))
+        mean = int(round(self.mean()))
+        if reverse:  # mate is the forward end, upstream of the mapped end
+            expected = position + read_length - mean
+        else:  # mate is the reverse end, downstream of the mapped end
+            expected = position + mean - read_length
+
+        return expected - slack, expected + read_length + slack
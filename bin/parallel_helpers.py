@@ -0,0 +1,55 @@
+import multiprocessing
+from collections import deque
+from instrumentation import COUNTERS, merge_counters
+
+WORKERS = multiprocessing.cpu_count()  # number of worker processes
+SHARED = {}  # read-only state for the workers, inherited through fork
+
+
+def run_counted(job):
+    """
+    :return: result of SHARED function for a job in a worker, with the counters it added
+    """
+    COUNTERS.clear()  # counts inherited from the parent through fork were already counted there
+    return SHARED['function'](job), dict(COUNTERS)
+
+
+def run_in_pool(function, jobs, workers=WORKERS, **shared):
+    """
+    :param function: top-level function called with each job, reads shared state from SHARED
+    :param jobs: iterable of jobs, consumed lazily
+    :param workers: number of worker processes, jobs run in this process if 1 or less
+    :param shared: state such as the reference and its index that every job needs
+    :return: generator of the results in job order
+    """
+    SHARED.clear()
+    SHARED.update(shared)
+
+    if workers <= 1:
+        for job in jobs:
+            yield function(job)
+        return
+
+    SHARED['function'] = function
+    pool = multiprocessing.Pool(workers)  # forked after SHARED is set - memory-mapped arrays stay shared
+    try:
+        pending = deque()
+        for job in jobs:
+            pending.append(pool.apply_async(run_counted, (job,)))
+            if len(pending) >= 2 * workers:  # keep only a few jobs in flight
+                yield collect(pending.popleft())
+        while pending:
+            yield collect(pending.popleft())
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def collect(pending_job):
+    """
+    :return: result of a finished worker job, adding its counters to the counters of this process
+    """
+    result, counters = pending_job.get()
+    merge_counters(counters)
+    return result
@@ -0,0 +1,146 @@
+import numpy as np
+from kmer_index import BASE_CODES, INVALID_BASE
+
+CHUNK_BITS = 16  # positions per chunk of counts = 2 ** CHUNK_BITS
+FLUSH_SIZE = 1 << 16  # pending variations counted at once
+
+
+class VariationTally(object):
+    """
+    Count of each mismatching base per reference position, kept sparse as sorted (position, base) keys and counts.
+    Workers tally their variations here and hand the counts to the pileup, which alone holds dense chunks.
+    Variations are buffered and counted in batches.
+    """
+
+    def __init__(self):
+        self.keys = np.zeros(0, dtype=np.int64)
+        self.key_counts = np.zeros(0, dtype=np.uint32)
+        self.pending_positions = []
+        self.pending_bases = []
+
+    def add(self, positions, bases):
+        """
+        :param positions: reference positions of variations
+        :param bases: base of the read at each position
+        """
+        self.pending_positions.extend(positions)
+        self.pending_bases.extend(bases)
+        if len(self.pending_positions) >= FLUSH_SIZE:
+            self.flush()
+
+    def flush(self):
+        """
+        :return: count all pending variations
+        """
+        if not self.pending_positions:
+            return
+        positions = np.array(self.pending_positions, dtype=np.int64)
+        bases = BASE_CODES[np.frombuffer(''.join(self.pending_bases), dtype=np.uint8)]
+        self.pending_positions, self.pending_bases = [], []
+
+        valid = (bases != INVALID_BASE) & (positions >= 0)
+        keys = np.concatenate((self.keys, positions[valid] * 4 + bases[valid]))
+        weights = np.concatenate((self.key_counts, np.ones(valid.sum(), dtype=np.uint32)))
+        self.keys, inverse = np.unique(keys, return_inverse=True)
+        self.key_counts = np.bincount(inverse, weights=weights, minlength=len(self.keys)).astype(np.uint32)
+
+    def counts(self):
+        """
+        :return: position, base code and count of every tallied variation
+        """
+        self.flush()
+        return self.keys >> 2, self.keys & 3, self.key_counts
+
+    def clear(self):
+        self.keys = np.zeros(0, dtype=np.int64)
+        self.key_counts = np.zeros(0, dtype=np.uint32)
+        self.pending_positions, self.pending_bases = [], []
+
+    def __len__(self):
+        """
+        :return: number of positions with a variation
+        """
+        self.flush()
+        return len(np.unique(self.keys >> 2))
+
+
+class Pileup(object):
+    """
+    Count of each mismatching base (A, C, G, T) per reference position.
+    Counts live in chunks of consecutive positions, so only regions with variations take memory.
+    Variations are tallied sparsely and counted into the chunks in batches.
+    """
+
+    def __init__(self):
+        self.chunks = {}
+        self.pending = VariationTally()
+
+    def add(self, positions, bases):
+        """
+        :param positions: reference positions of variations
+        :param bases: base of the read at each position
+        """
+        self.pending.add(positions, bases)
+        if len(self.pending.keys) >= FLUSH_SIZE:
+            self.flush()
+
+    def flush(self):
+        """
+        :return: count all pending variations
+        """
+        self.add_counts(*self.pending.counts())
+        self.pending.clear()
+
+    def add_counts(self, positions, bases, counts):
+        """
+        :return: add counts of bases at positions, grouped by chunk
+        """
+        chunk_ids = positions >> CHUNK_BITS
+        order = np.argsort(chunk_ids, kind='mergesort')
+        chunk_ids, positions, bases, counts = chunk_ids[order], positions[order], bases[order], counts[order]
+        bounds = np.flatnonzero(np.diff(chunk_ids)) + 1
+
+        for first, last in zip(np.concatenate(([0], bounds)), np.concatenate((bounds, [len(chunk_ids)]))):
+            if first == last:
+                continue
+            chunk_id = int(chunk_ids[first])
+            if chunk_id not in self.chunks:
+                self.chunks[chunk_id] = np.zeros((1 << CHUNK_BITS, 4), dtype=np.uint32)
+            offsets = positions[first:last] & ((1 << CHUNK_BITS) - 1)
+            np.add.at(self.chunks[chunk_id], (offsets, bases[first:last]), counts[first:last])
+
+    def merge(self, tally):
+        """
+        :param tally: variations tallied by a worker
+        :return: add all counts of the tally
+        """
+        self.add_counts(*tally.counts())
+
+    def call(self, threshold):
+        """
+        :param threshold: least count of the most frequent base
+        :return: sorted positions whose most frequent base reaches threshold, and that base's code
+        """
+        self.flush()
+        all_positions, all_bases = [], []
+        for chunk_id in sorted(self.chunks):
+            counts = self.chunks[chunk_id]
+            best = counts.argmax(axis=1)  # ties go to the first of A, C, G, T
+            called = np.flatnonzero(counts[np.arange(len(counts)), best] >= threshold)
+            all_positions.append(called + (chunk_id << CHUNK_BITS))
+            all_bases.append(best[called])
+
+        if not all_positions:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        return np.concatenate(all_positions), np.concatenate(all_bases)
+
+    def clear(self):
+        self.chunks.clear()
+        self.pending.clear()
+
+    def __len__(self):
+        """
+        :return: number of positions with a variation
+        """
+        self.flush()
+        return sum(int((counts.sum(axis=1) > 0).sum()) for counts in self.chunks.itervalues())
@@ -0,0 +1,127 @@
+import os
+import numpy as np
+import logging as logger
+
+logger.basicConfig(level=logger.INFO, format='> %(message)s')
+
+
+class Reference(object):
+    """
+    Reference sequence backed by a memory-mapped buffer of ascii bases.
+    Slicing returns strings, view returns a numpy array sharing the buffer.
+    """
+
+    def __init__(self, name, bases):
+        self.name = name
+        self.bases = bases
+
+    def __len__(self):
+        return len(self.bases)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return self.bases[item].tostring()
+        return chr(self.bases[item])
+
+    def __str__(self):
+        return self.bases.tostring()
+
+    def view(self, start, end):
+        """
+        :return: bases between start and end without copying
+        """
+        return self.bases[max(0, start):max(0, end)]
+
+
+def as_byte_array(sequence):
+    """
+    :param sequence: Reference, string, bytearray or uint8 array
+    :return: uint8 array of the ascii bases sharing memory with the sequence
+    """
+    if isinstance(sequence, Reference):
+        return sequence.bases
+    if isinstance(sequence, np.ndarray):
+        return sequence
+    return np.frombuffer(sequence, dtype=np.uint8)
+
+
+def sidecar_paths(reference_file_name):
+    """
+    :return: locations of the packed sequence and its record index
+    """
+    return reference_file_name + ".seq", reference_file_name + ".idx"
+
+
+def pack_reference_file(reference_file_name):
+    """
+    :param reference_file_name: location of the reference file
+    :return: writes all records of the reference one after another without headers or line breaks
+             and an index with name, length and offset of each record
+    """
+    sequence_path, index_path = sidecar_paths(reference_file_name)
+    records = []
+    offset = 0
+
+    with open(reference_file_name, 'r') as f, open(sequence_path, 'wb') as out:
+        for line in f:
+            if line.startswith('>'):  # header of a new record
+                records.append([line[1:].strip(), 0, offset])
+                continue
+            line = line.strip()
+            if not records:
+                records.append(['', 0, offset])
+            out.write(line)
+            records[-1][1] += len(line)
+            offset += len(line)
+
+    with open(index_path, 'w') as f:
+        for name, length, start in records:
+            f.write("{}\t{}\t{}\n".format(name, length, start))
+
+
+def read_reference_index(reference_file_name):
+    """
+    :return: name, length and offset of every record in the reference
+    """
+    records = []
+    with open(sidecar_paths(reference_file_name)[1], 'r') as f:
+        for line in f:
+            name, length, offset = line.rstrip('\n').split('\t')
+            records.append((name, int(length), int(offset)))
+    return records
+
+
+def load_reference(reference_file_name, name=None):
+    """
+    :param reference_file_name: location of the reference file
+    :param name: record to load, first record if not given
+    :return: reference memory-mapped from the packed sequence, which is created on first use
+    """
+    return load_reference_records(reference_file_name, [name] if name is not None else None)[0]
+
+
+def load_reference_records(reference_file_name, names=None):
+    """
+    :param reference_file_name: location of the reference file
+    :param names: records to load, all records if not given
+    :return: one Reference per record in file order
+    """
+    sequence_path, index_path = sidecar_paths(reference_file_name)
+    if not os.path.exists(index_path) or os.path.getmtime(index_path) < os.path.getmtime(reference_file_name):
+        logger.info("Packing reference file {}".format(reference_file_name))
+        pack_reference_file(reference_file_name)
+
+    records = read_reference_index(reference_file_name)
+    if os.path.getsize(sequence_path) == 0:
+        packed = np.zeros(0, dtype=np.uint8)
+    else:
+        packed = np.memmap(sequence_path, dtype=np.uint8, mode='r')
+
+    references = []
+    for name, length, offset in records:
+        if names is None or name in names:
+            references.append(Reference(name, packed[offset:offset + length]))
+    if names is not None and len(references) != len(names):
+        raise KeyError("Records {} not found in {}".format(names, reference_file_name))
+
+    return references
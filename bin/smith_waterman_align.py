@@ -1,5 +1,7 @@
 import re
 import improved_helpers
+import instrumentation
+import numpy as np
 import logging as logger
 
 logger.basicConfig(level=logger.INFO, format='> %(message)s')
@@ -7,6 +9,7 @@ logger.basicConfig(level=logger.INFO, format='> %(message)s')
 match_award = 10
 mismatch_penalty = -5
 gap_penalty = -5
+BATCH_SIZE = 256  # alignments filled together
 
 
 def make_matrix(shape):
@@ -53,57 +56,110 @@ def add_symbols(align_seq_1, align_seq_2):
 
 
 def waterman_algorithm(seq_1, seq_2):
-    global max_i, max_j
-
-    m, n = len(seq_1), len(seq_2)  # length of two sequences
-
-    # Generate DP table and traceback path pointer matrix
-    score = make_matrix((m + 1, n + 1))  # the DP table
-    pointer = make_matrix((m + 1, n + 1))  # to store the traceback path
-
-    max_score = 0  # initial maximum score in DP table
-
-    # Calculate DP table and mark pointers
-    for i in range(1, m + 1):
-        for j in range(1, n + 1):
-            score_diagonal = score[i - 1][j - 1] + match_score(seq_1[i - 1], seq_2[j - 1])
-            score_up = score[i][j - 1] + gap_penalty
-            score_left = score[i - 1][j] + gap_penalty
-            score[i][j] = max(0, score_left, score_up, score_diagonal)
-            if score[i][j] == 0:
-                pointer[i][j] = 0  # 0 means end of the path
-            if score[i][j] == score_left:
-                pointer[i][j] = 1  # 1 means trace up
-            if score[i][j] == score_up:
-                pointer[i][j] = 2  # 2 means trace left
-            if score[i][j] == score_diagonal:
-                pointer[i][j] = 3  # 3 means trace diagonal
-            if score[i][j] >= max_score:
-                max_i = i
-                max_j = j
-                max_score = score[i][j]
+    """
+    :return: local alignment of two sequences, False, False if there is none
+    """
+    return waterman_algorithm_batch([(seq_1, seq_2)])[0]
+
+
+def score_columns(codes_1, codes_2):
+    """
+    :param codes_1: (batch, m) ascii codes of the first sequences
+    :param codes_2: (batch, n) ascii codes of the second sequences
+    :return: DP table and traceback pointers of every pair, filled one column at a time for the whole batch
+    """
+    batch, m = codes_1.shape
+    n = codes_2.shape[1]
+    score = np.zeros((batch, m + 1, n + 1), dtype=np.int32)
+    pointer = np.zeros((batch, m + 1, n + 1), dtype=np.int8)
+
+    rows = np.arange(m + 1, dtype=np.int32)
+    gap_rows = gap_penalty * rows
+    gap_1 = codes_1 == ord('-')
+
+    for j in xrange(1, n + 1):
+        column = codes_2[:, j - 1][:, None]
+        match = np.where(codes_1 == column, match_award,
+                         np.where(gap_1 | (column == ord('-')), gap_penalty, mismatch_penalty))
+
+        previous = score[:, :, j - 1]
+        score_diagonal = previous[:, :-1] + match
+        score_up = previous[:, 1:] + gap_penalty
+        best = np.maximum(0, np.maximum(score_diagonal, score_up))
+
+        # score[i][j] = max(best[i], score[i - 1][j] + gap) unrolls into a running maximum down the column
+        current = np.zeros((batch, m + 1), dtype=np.int32)
+        current[:, 1:] = best - gap_rows[1:]
+        current = np.maximum.accumulate(current, axis=1) + gap_rows
+        score[:, :, j] = current
+
+        score_left = current[:, :-1] + gap_penalty
+        current = current[:, 1:]
+        pointer[:, 1:, j] = np.where(current == score_diagonal, 3,
+                                     np.where(current == score_up, 2,
+                                              np.where(current == score_left, 1, 0)))
+
+    return score, pointer
 
-    align_1, align_2 = '', ''  # initial sequences
 
-    i, j = max_i, max_j  # indices of path starting point
+def waterman_algorithm_batch(pairs):
+    """
+    :param pairs: (seq_1, seq_2) pairs to align - seq_1 is the reference window the rescue expects seq_2 in,
+                  so the window bounds how far an alignment strays from the expected position
+    :return: local alignment of each pair, False, False for pairs without one
+    """
+    alignments = []
+    for chunk in xrange(0, len(pairs), BATCH_SIZE):
+        chunk_pairs = pairs[chunk:chunk + BATCH_SIZE]
+        m = max(len(seq_1) for seq_1, _ in chunk_pairs)
+        n = max(len(seq_2) for _, seq_2 in chunk_pairs)
+
+        # pad sequences with characters that never match - padded cells lie after every real cell
+        codes_1 = np.zeros((len(chunk_pairs), m), dtype=np.uint8)
+        codes_2 = np.ones((len(chunk_pairs), n), dtype=np.uint8)
+        for k, (seq_1, seq_2) in enumerate(chunk_pairs):
+            codes_1[k, :len(seq_1)] = np.frombuffer(seq_1, dtype=np.uint8)
+            codes_2[k, :len(seq_2)] = np.frombuffer(seq_2, dtype=np.uint8)
+
+        score, pointer = score_columns(codes_1, codes_2)
+        instrumentation.count('dp_cells', len(chunk_pairs) * m * n)
+        for k, (seq_1, seq_2) in enumerate(chunk_pairs):
+            alignments.append(traceback(seq_1, seq_2, score[k], pointer[k]))
+
+    return alignments
+
+
+def traceback(seq_1, seq_2, score, pointer):
+    """
+    :return: aligned sequences following the pointers back from the last maximum of the DP table
+    """
+    m, n = len(seq_1), len(seq_2)
+    if m == 0 or n == 0:
+        return False, False
+
+    cells = score[1:m + 1, 1:n + 1].ravel()
+    last_max = len(cells) - 1 - np.argmax(cells[::-1])
+    i, j = last_max // n + 1, last_max % n + 1  # indices of path starting point
+
+    align_1, align_2 = '', ''  # initial sequences
 
     # traceback, follow pointers
-    try:
-        while pointer[i][j] != 0:
-            if pointer[i][j] == 3:
-                align_1 += seq_1[i - 1]
-                align_2 += seq_2[j - 1]
-                i -= 1
-                j -= 1
-            elif pointer[i][j] == 2:
-                align_1 += '-'
-                align_2 += seq_2[j - 1]
-                j -= 1
-            elif pointer[i][j] == 1:
-                align_1 += seq_1[i - 1]
-                align_2 += '-'
-                i -= 1
-    except:
+    while pointer[i, j] != 0:
+        if pointer[i, j] == 3:
+            align_1 += seq_1[i - 1]
+            align_2 += seq_2[j - 1]
+            i -= 1
+            j -= 1
+        elif pointer[i, j] == 2:
+            align_1 += '-'
+            align_2 += seq_2[j - 1]
+            j -= 1
+        elif pointer[i, j] == 1:
+            align_1 += seq_1[i - 1]
+            align_2 += '-'
+            i -= 1
+
+    if not align_1:
         return False, False
 
     return add_symbols(align_1, align_2)
@@ -0,0 +1,166 @@
+import os
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+import logging as logger
+
+logger.basicConfig(level=logger.INFO, format='> %(message)s')
+
+CACHE_VERSION = 2  # part of every key - bump when a stage starts computing different results
+CACHE_BUDGET = 8 << 30  # bytes of cached stages kept before the least recently used are removed
+DIGEST_CHUNK = 1 << 24  # bytes of an input file hashed at once
+DIGESTS = {}  # content digests of input files, by location, size and modification time
+DIGEST_FILE = 'digests.txt'  # digests kept in the cache folder between runs - digest, size, mtime and location
+LOADED_DIGESTS = set()  # cache folders whose digest file has been read
+
+
+def load_digests(cache_folder):
+    """
+    :return: adds the digests kept in the cache folder to DIGESTS, once per folder
+    """
+    path = os.path.join(cache_folder, DIGEST_FILE)
+    if cache_folder in LOADED_DIGESTS or not os.path.exists(path):
+        return
+    LOADED_DIGESTS.add(cache_folder)
+    with open(path) as f:
+        for line in f:
+            fields = line.rstrip('\n').split('\t', 3)
+            if len(fields) == 4:  # a line cut short by an interrupted run is skipped
+                digest, size, mtime, file_path = fields
+                DIGESTS[(file_path, int(size), float(mtime))] = digest
+
+
+def file_digest(file_path, cache_folder=None):
+    """
+    :param cache_folder: where the digest is kept for later runs, only in memory if not given
+    :return: sha1 of the contents of a file, computed once per version of the file
+    """
+    status = os.stat(file_path)
+    memo = (os.path.abspath(file_path), status.st_size, status.st_mtime)
+    if memo not in DIGESTS and cache_folder is not None:
+        load_digests(cache_folder)
+    if memo not in DIGESTS:
+        digest = hashlib.sha1()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(DIGEST_CHUNK), ''):
+                digest.update(chunk)
+        DIGESTS[memo] = digest.hexdigest()
+
+        if cache_folder is not None:
+            if not os.path.isdir(cache_folder):
+                os.makedirs(cache_folder)
+            with open(os.path.join(cache_folder, DIGEST_FILE), 'a') as f:  # one short append per file version
+                f.write("{}\t{}\t{!r}\t{}\n".format(DIGESTS[memo], memo[1], memo[2], memo[0]))
+    return DIGESTS[memo]
+
+
+def stage_key(stage, files=(), params=None, depends=(), cache_folder=None):
+    """
+    :param stage: name of the stage
+    :param files: input files whose contents the stage reads
+    :param params: parameters the results depend on
+    :param depends: keys of the stages whose results this stage reads
+    :param cache_folder: where the digests of the input files are kept, so later runs do not hash them again
+    :return: key that changes whenever the stage, its inputs or any stage it depends on change
+    """
+    digest = hashlib.sha1()
+    digest.update("{}\n{}\n".format(CACHE_VERSION, stage))
+    for file_path in files:
+        digest.update(file_digest(file_path, cache_folder) + "\n")
+    for name, value in sorted((params or {}).items()):
+        digest.update("{}={!r}\n".format(name, value))
+    for key in depends:
+        digest.update(key + "\n")
+    return digest.hexdigest()
+
+
+def entry_path(cache_folder, stage, key):
+    return os.path.join(cache_folder, "{}-{}".format(stage, key))
+
+
+def load_stage(cache_folder, stage, key):
+    """
+    :return: arrays of a cached stage by name, memory-mapped from hard-disk - None if the stage is not cached
+    """
+    path = entry_path(cache_folder, stage, key)
+    if not os.path.isdir(path):
+        return None
+
+    os.utime(path, None)  # mark as recently used
+    arrays = {}
+    for name in os.listdir(path):
+        if name.endswith('.npy'):
+            arrays[name[:-len('.npy')]] = np.load(os.path.join(path, name), mmap_mode='r')
+    return arrays
+
+
+def store_stage(cache_folder, stage, key, arrays, budget=None):
+    """
+    :param arrays: results of the stage as numpy arrays by name
+    :param budget: bytes of cached stages kept, CACHE_BUDGET if not given
+    :return: writes the arrays to a temporary folder that is renamed into place once complete,
+             so an interrupted run never leaves a partial stage behind
+    """
+    if not os.path.isdir(cache_folder):
+        os.makedirs(cache_folder)
+
+    path = entry_path(cache_folder, stage, key)
+    partial = tempfile.mkdtemp(prefix='.' + stage + '-', dir=cache_folder)
+    try:
+        for name, array in arrays.iteritems():
+            np.save(os.path.join(partial, name + '.npy'), array)
+        os.rename(partial, path)
+    except OSError:
+        if not os.path.isdir(path):  # a concurrent run finishing the same stage first is not an error
+            raise
+    finally:
+        if os.path.isdir(partial):
+            shutil.rmtree(partial)
+
+    evict_stages(cache_folder, budget, keep=path)
+
+
+def folder_size(path):
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+
+def evict_stages(cache_folder, budget=None, keep=None):
+    """
+    :return: removes the least recently used stages until the cache fits in the budget, CACHE_BUDGET if not given
+    """
+    if budget is None:
+        budget = CACHE_BUDGET
+    entries = []
+    for name in os.listdir(cache_folder):
+        path = os.path.join(cache_folder, name)
+        if not name.startswith('.') and os.path.isdir(path):
+            entries.append((os.path.getmtime(path), path, folder_size(path)))
+
+    total = sum(size for _, _, size in entries)
+    for _, path, size in sorted(entries):
+        if total <= budget:
+            break
+        if path == keep:
+            continue
+        logger.info("Evicting cached stage {}".format(os.path.basename(path)))
+        shutil.rmtree(path)
+        total -= size
+
+
+def pack_strings(strings):
+    """
+    :return: strings as one array of their bytes and the offsets where each string starts, ending with the total
+    """
+    offsets = np.zeros(len(strings) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(string) for string in strings])
+    return np.frombuffer(''.join(strings), dtype=np.uint8), offsets
+
+
+def unpack_strings(data, offsets):
+    """
+    :return: strings packed by pack_strings
+    """
+    data = np.asarray(data).tostring()
+    offsets = offsets.tolist()
+    return [data[first:last] for first, last in zip(offsets[:-1], offsets[1:])]
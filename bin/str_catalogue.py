@@ -0,0 +1,250 @@
+import re
+import numpy as np
+import logging as logger
+import helpers
+import instrumentation
+from helpers import canonical_motif, get_genome_tandem_repeats, preprocess_tandems, tandem_repeat_hits, \
+    find_clean_cut_positions
+from reference import load_reference_records
+from stage_cache import load_stage, store_stage, stage_key, pack_strings, unpack_strings
+from parallel_helpers import WORKERS
+
+logger.basicConfig(level=logger.INFO, format='> %(message)s')
+
+MOTIF_TYPE = 'S5'  # STR units are 2 to 5 bases
+REGION = re.compile(r'^(.*?)(?::(\d+)-(\d+))?$')  # record, or record:start-end
+
+
+class StrCatalogue(object):
+    """
+    Reference STRs stored as columns - record, unit, canonical unit, start, repeats and end - sorted by record
+    and start. Rows hold every STR the scan finds, and mark those preprocess_tandems keeps as processed - queries
+    return processed rows, the incremental donor rescan reads all of them along with the clean cuts of each record.
+    Each record's rows carry the running maximum of their ends, so the rows overlapping a region are found by
+    two binary searches; processed rows are also ordered by canonical unit for motif queries.
+    Columns may be memory-mapped, a query only reads the rows it needs.
+    """
+
+    def __init__(self, arrays):
+        """
+        :param arrays: columns and indexes by name, as catalogue_arrays builds them
+        """
+        self.arrays = arrays
+        self.names = unpack_strings(arrays['names'], arrays['name_offsets'])
+        self.record_numbers = dict((name, number) for number, name in enumerate(self.names))
+        self.record_offsets = arrays['record_offsets']
+        self.units = arrays['units']
+        self.canonical_units = arrays['canonical_units']
+        self.starts = arrays['starts']
+        self.repeats = arrays['repeats']
+        self.ends = arrays['ends']
+        self.max_ends = arrays['max_ends']
+        self.processed = arrays['processed']
+        self.motif_keys = arrays['motif_keys']
+        self.motif_offsets = arrays['motif_offsets']
+        self.motif_rows = arrays['motif_rows']
+        self.clean_cuts = arrays['clean_cuts']
+        self.cut_offsets = arrays['cut_offsets']
+
+    def __len__(self):
+        """
+        :return: number of processed STRs
+        """
+        return int(np.count_nonzero(self.processed))
+
+    def record_number(self, record):
+        """
+        :return: position of a record in the catalogue
+        """
+        if record not in self.record_numbers:
+            raise KeyError("Record {} not in the STR catalogue".format(record))
+        return self.record_numbers[record]
+
+    def record_rows(self, record):
+        """
+        :return: first and last row of a record
+        """
+        number = self.record_number(record)
+        return int(self.record_offsets[number]), int(self.record_offsets[number + 1])
+
+    def record_strs(self, record):
+        """
+        :return: processed rows of a record, in position order
+        """
+        first, last = self.record_rows(record)
+        return first + np.flatnonzero(self.processed[first:last])
+
+    def record_hits(self, record):
+        """
+        :return: (STR, start-index, repeats) of every STR the scan finds in a record, processed or not
+        """
+        first, last = self.record_rows(record)
+        return zip(self.units[first:last].tolist(), self.starts[first:last].tolist(),
+                   self.repeats[first:last].tolist())
+
+    def record_clean_cuts(self, record):
+        """
+        :return: sorted clean cuts of a record
+        """
+        number = self.record_number(record)
+        return self.clean_cuts[self.cut_offsets[number]:self.cut_offsets[number + 1]]
+
+    def overlapping(self, record, start, end):
+        """
+        :param record: name of the reference record
+        :param start: first position of the region
+        :param end: position after the region
+        :return: processed rows of the STRs overlapping the region, in position order
+        """
+        first, last = self.record_rows(record)
+        # rows before the first running end past start all end before the region
+        low = first + int(np.searchsorted(self.max_ends[first:last], start, side='right'))
+        high = first + int(np.searchsorted(self.starts[first:last], end, side='left'))
+        if low >= high:
+            return np.zeros(0, dtype=np.int64)
+        return low + np.flatnonzero((self.ends[low:high] > start) & self.processed[low:high])
+
+    def motif(self, STR, exact=False):
+        """
+        :param STR: STR unit
+        :param exact: only the unit itself, not its rotations
+        :return: processed rows of every STR of the unit's canonical unit, in record and position order
+        """
+        key = canonical_motif(STR)
+        number = int(np.searchsorted(self.motif_keys, key))
+        if number == len(self.motif_keys) or self.motif_keys[number] != key:
+            return np.zeros(0, dtype=np.int64)
+
+        rows = np.asarray(self.motif_rows[self.motif_offsets[number]:self.motif_offsets[number + 1]])
+        if exact:
+            rows = rows[self.units[rows] == STR]
+        return rows
+
+    def loci(self, rows):
+        """
+        :return: (record, STR unit, start, repeats) of every row
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        records = np.searchsorted(self.record_offsets, rows, side='right') - 1
+        return [(self.names[record], unit, start, repeats) for record, unit, start, repeats in
+                zip(records.tolist(), self.units[rows].tolist(), self.starts[rows].tolist(),
+                    self.repeats[rows].tolist())]
+
+    def output_records(self, rows):
+        """
+        :return: STR records of the rows as output_to_file writes them
+        """
+        return [[STR * repeats, start] for _, STR, start, repeats in self.loci(rows)]
+
+
+def catalogue_loci(tandem_repeats):
+    """
+    :param tandem_repeats: STRs as get_genome_tandem_repeats finds them
+    :return: (STR, start, repeats, processed) of every STR - processed marks the STRs preprocess_tandems keeps,
+             each with the shortest unit it was found with, so TG * 10 is not stored as TGTG * 5
+    """
+    kept = set((expanded, index) for expanded, index in preprocess_tandems(tandem_repeats))
+    hits = tandem_repeat_hits(tandem_repeats)
+
+    units = {}
+    for STR, index, repeats in hits:
+        locus = (STR * repeats, index)
+        if locus in kept and (locus not in units or len(STR) < len(units[locus])):
+            units[locus] = STR
+
+    return [(STR, index, repeats, units.get((STR * repeats, index)) == STR) for STR, index, repeats in hits]
+
+
+def catalogue_arrays(names, all_loci, all_clean_cuts):
+    """
+    :param names: record names
+    :param all_loci: (STR, start, repeats, processed) of every STR of each record
+    :param all_clean_cuts: sorted clean cuts of each record
+    :return: columns and indexes of the catalogue
+    """
+    record_offsets = np.zeros(len(names) + 1, dtype=np.int64)
+    record_offsets[1:] = np.cumsum([len(loci) for loci in all_loci])
+    loci = [locus for record_loci in all_loci
+            for locus in sorted(record_loci, key=lambda locus: (locus[1], len(locus[0]), locus[0]))]
+
+    units = np.array([locus[0] for locus in loci], dtype=MOTIF_TYPE)
+    canonical_units = np.array([canonical_motif(locus[0]) for locus in loci], dtype=MOTIF_TYPE)
+    starts = np.array([locus[1] for locus in loci], dtype=np.int64)
+    repeats = np.array([locus[2] for locus in loci], dtype=np.int64)
+    processed = np.array([locus[3] for locus in loci], dtype=bool)
+    ends = starts + repeats * np.char.str_len(units)
+
+    # running maximum of the ends, restarted at every record
+    max_ends = np.zeros(len(loci), dtype=np.int64)
+    for first, last in zip(record_offsets[:-1], record_offsets[1:]):
+        max_ends[first:last] = np.maximum.accumulate(ends[first:last])
+
+    # processed rows of each canonical unit, in record and position order
+    rows = np.flatnonzero(processed)
+    motif_rows = rows[np.lexsort((rows, canonical_units[rows]))]
+    motif_keys, counts = np.unique(canonical_units[rows], return_counts=True)
+    motif_offsets = np.zeros(len(motif_keys) + 1, dtype=np.int64)
+    motif_offsets[1:] = np.cumsum(counts)
+
+    cut_offsets = np.zeros(len(names) + 1, dtype=np.int64)
+    cut_offsets[1:] = np.cumsum([len(clean_cuts) for clean_cuts in all_clean_cuts])
+
+    packed_names, name_offsets = pack_strings(names)
+    return {'names': packed_names, 'name_offsets': name_offsets, 'record_offsets': record_offsets,
+            'units': units, 'canonical_units': canonical_units, 'starts': starts, 'repeats': repeats, 'ends': ends,
+            'max_ends': max_ends, 'processed': processed, 'motif_keys': motif_keys.astype(MOTIF_TYPE),
+            'motif_offsets': motif_offsets, 'motif_rows': motif_rows.astype(np.int64),
+            'clean_cuts': np.concatenate([np.zeros(0, dtype=np.int64)] + list(all_clean_cuts)).astype(np.int64),
+            'cut_offsets': cut_offsets}
+
+
+def build_str_catalogue(references, workers=WORKERS):
+    """
+    :param references: records of the reference
+    :return: catalogue of the STRs and clean cuts of every record, as the baseline finds them
+    """
+    all_tandem_repeats = get_genome_tandem_repeats(references, workers)  # timed as its own stage
+
+    with instrumentation.stage('str_catalogue') as record:
+        all_loci = [catalogue_loci(tandem_repeats) for tandem_repeats in all_tandem_repeats]
+        all_clean_cuts = [find_clean_cut_positions(reference) for reference in references]
+        record.items = sum(len(reference) for reference in references)
+        return StrCatalogue(catalogue_arrays([reference.name for reference in references], all_loci,
+                                             all_clean_cuts))
+
+
+def get_str_catalogue_key(reference_file_path, cache_folder=None):
+    """
+    :param cache_folder: location of the stage cache, which keeps the digest of the reference file
+    :return: stage key of the STR catalogue, from the contents of the reference file and the STR threshold
+    """
+    return stage_key('str_catalogue', files=[reference_file_path], params={'STR_THRESHOLD': helpers.STR_THRESHOLD},
+                     cache_folder=cache_folder)
+
+
+def get_str_catalogue(reference_file_path, cache_folder, workers=WORKERS):
+    """
+    :return: STR catalogue of every record of the reference file, memory-mapped from the cache or built
+    """
+    key = get_str_catalogue_key(reference_file_path, cache_folder)
+    cached = load_stage(cache_folder, 'str_catalogue', key)
+    if cached is not None:
+        logger.info("Loading STR catalogue from the cache")
+        return StrCatalogue(cached)
+
+    logger.info("Building STR catalogue of {}".format(reference_file_path))
+    catalogue = build_str_catalogue(load_reference_records(reference_file_path), workers)
+    store_stage(cache_folder, 'str_catalogue', key, catalogue.arrays)
+    return StrCatalogue(load_stage(cache_folder, 'str_catalogue', key))
+
+
+def parse_region(region, catalogue):
+    """
+    :param region: record, or record:start-end with 0-based start and exclusive end
+    :return: record, start and end of the region - the whole record if no positions are given
+    """
+    record, start, end = REGION.match(region).groups()
+    if start is None:
+        first, last = catalogue.record_rows(record)
+        return record, 0, int(catalogue.max_ends[last - 1]) if last > first else 0
+    return record, int(start), int(end)
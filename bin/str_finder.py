@@ -0,0 +1,284 @@
+import os
+import time
+import argparse
+import resource
+import helpers
+import instrumentation
+import stage_cache
+import improved_helpers
+import data_variables
+import str_catalogue
+import str_genotyper
+from helpers import *
+from improved_helpers import *
+from STR_Finder_Improved import map_reads_snps, map_reads_indels
+
+logger.basicConfig(level=logger.INFO, format='> %(message)s')
+
+MEGABYTE = 1 << 20
+
+
+def configure(args):
+    """
+    :return: sets the thresholds and limits given on the command line - before any worker is forked,
+             so the workers see the same values
+    """
+    if getattr(args, 'str_threshold', None) is not None:
+        helpers.STR_THRESHOLD = args.str_threshold
+    for name in ('READ_LENGTH', 'KEY_LENGTH', 'SNP_THRESHOLD', 'MAX_SEED_HITS'):
+        value = getattr(args, name.lower(), None)
+        if value is not None:
+            setattr(improved_helpers, name, value)
+    if improved_helpers.KEY_LENGTH < 1:
+        raise ValueError("key length {} must be at least 1".format(improved_helpers.KEY_LENGTH))
+    k = improved_helpers.READ_LENGTH / improved_helpers.KEY_LENGTH  # length of the indexed k-mers and seeds
+    if not 1 <= k <= MAX_KMER_LENGTH:
+        raise ValueError("read length / key length gives k-mers of {} bases - it must be between 1 and {}".format(
+            k, MAX_KMER_LENGTH))
+    if getattr(args, 'cache_budget', None) is not None:
+        stage_cache.CACHE_BUDGET = args.cache_budget * MEGABYTE
+    if args.memory_limit is not None:  # address space of this process and every worker forked from it
+        limit = args.memory_limit * MEGABYTE
+        resource.setrlimit(resource.RLIMIT_AS, (limit, resource.getrlimit(resource.RLIMIT_AS)[1]))
+
+
+def input_paths(args):
+    """
+    :return: reference file, reads file and base output file name - given on the command line or from the dataset
+    """
+    reference_file_path, reads_file_path, base_name = data_variables.dataset_paths(args.dataset, args.data_folder)
+    if args.reference is not None:
+        reference_file_path, base_name = args.reference, os.path.basename(args.reference)
+    if getattr(args, 'reads', None) is not None:
+        reads_file_path = args.reads
+    return reference_file_path, reads_file_path, base_name
+
+
+def output_path(args, prefix, base_name):
+    return args.output if args.output is not None else prefix + base_name
+
+
+def load_inputs(args):
+    """
+    :return: reference, stage keys and the reads of a run that maps reads
+    """
+    reference_file_path, reads_file_path, _ = input_paths(args)
+    logger.info("Reading Reference File : {}".format(reference_file_path))
+    reference = load_reference(reference_file_path, args.record)  # memory-map the reference file
+    return reference, reads_file_path, get_stage_keys(reference, reference_file_path, reads_file_path, args.cache)
+
+
+def find_snps(args, reference, reads_file_path, keys):
+    """
+    :return: SNPs of the reads, from the cache or by mapping the reads against the index
+    """
+    index_key, snp_key, _ = keys
+    hashed_reference_map = created_hashed_map(reference, args.cache, index_key)
+    reads = read_pairs_in_batches(reads_file_path, args.batch_size)  # opened only if the SNPs are not cached
+    return process_snps(map_reads_snps(reads, hashed_reference_map, reference, snp_key, args.cache, args.workers))
+
+
+def find_indels(args, reference, reads_file_path, keys, SNPs=None):
+    """
+    :param SNPs: SNPs already found by find_snps in this run - the reads are mapped first if not given
+    :return: deletions and insertions of the unmapped reads
+    """
+    if SNPs is None:
+        find_snps(args, reference, reads_file_path, keys)  # the unmapped reads are stored with the SNPs
+    INDELs = map_reads_indels(reference, keys[1], keys[2], args.cache, args.workers)
+    return process_indels(INDELs[0]), process_indels(INDELs[1])
+
+
+def find_donor_strs(args, reference, SNPs, INDELs):
+    """
+    :return: STRs of the donor at their reference positions - genotyped from the reads spanning the reference STRs,
+             or from the reassembled donor rescanned only around the variants unless a full scan is asked for
+    """
+    if args.genotype_strs:
+        reference_file_path, reads_file_path, _ = input_paths(args)
+        catalogue = str_catalogue.get_str_catalogue(reference_file_path, args.cache, args.workers)
+        genotypes = str_genotyper.genotype_strs(reference, catalogue, reads_file_path, args.workers, args.batch_size)
+        return str_genotyper.genotyped_strs(genotypes)
+
+    donor, donor_assembly = create_donor_sequence(reference, SNPs, INDELs)  # recreate donor sequence
+    if args.full_str_scan:
+        STRs = get_tandem_repeats(donor, args.workers)
+    else:
+        catalogue = str_catalogue.get_str_catalogue(input_paths(args)[0], args.cache, args.workers)
+        STRs = get_incremental_tandem_repeats(reference, catalogue, donor, donor_assembly, SNPs, INDELs)
+    return find_reference_position(STRs, donor_assembly)
+
+
+def run_baseline(args):
+    reference_file_path, _, base_name = input_paths(args)
+    logger.info("Reading Reference File : {}".format(reference_file_path))
+    record_STRs = get_reference_file_tandem_repeats(reference_file_path, args.workers,
+                                                    [args.record] if args.record is not None else None)
+    logger.info("Total Number of STRs found : {}".format(sum(len(STRs) for _, STRs in record_STRs)))
+
+    output_reference_strs(record_STRs, output_path(args, "baseline_", base_name))
+
+
+def run_index(args):
+    reference_file_path = input_paths(args)[0]
+    logger.info("Reading Reference File : {}".format(reference_file_path))
+    reference = load_reference(reference_file_path, args.record)
+    created_hashed_map(reference, args.cache, get_index_key(reference, reference_file_path, args.cache))
+
+
+def run_map(args):
+    SNPs = find_snps(args, *load_inputs(args))
+    logger.info("Total Number of SNPs : {}".format(len(SNPs)))
+
+
+def run_indels(args):
+    INDELs = find_indels(args, *load_inputs(args))
+    logger.info("Total Number of INS : {}".format(len(INDELs[1])))
+    logger.info("Total Number of DEL : {}".format(len(INDELs[0])))
+
+
+def run_improved(args):
+    """
+    :return: runs every stage - stages already in the cache are loaded instead - and writes the output
+    """
+    reference, reads_file_path, keys = load_inputs(args)
+    output_file_name = output_path(args, "improved_", input_paths(args)[2])
+
+    with VariantWriter(output_file_name, variant_file_name(output_file_name)) as writer:
+        SNPs = find_snps(args, reference, reads_file_path, keys)
+        writer.write_section('SNP', SNPs)
+
+        INDELs = find_indels(args, reference, reads_file_path, keys, SNPs)
+        writer.write_section('DEL', INDELs[0])
+        writer.write_section('INS', INDELs[1])
+
+        STRs = find_donor_strs(args, reference, SNPs, INDELs)
+        writer.write_section('STR', STRs)
+
+    logger.info("Total Number of SNPs : {}".format(len(SNPs)))
+    logger.info("Total Number of INS : {}".format(len(INDELs[1])))
+    logger.info("Total Number of DEL : {}".format(len(INDELs[0])))
+    logger.info("Total Number of STRs : {}".format(len(STRs)))
+
+
+def run_str(args):
+    """
+    :return: STRs of the donor rebuilt from the SNPs and INDELs, which are taken from the cache when present
+    """
+    reference, reads_file_path, keys = load_inputs(args)
+    SNPs, INDELs = [], ([], [])  # genotyping reads the STRs straight from the reads
+    if not args.genotype_strs:
+        SNPs = find_snps(args, reference, reads_file_path, keys)
+        INDELs = find_indels(args, reference, reads_file_path, keys, SNPs)
+
+    STRs = find_donor_strs(args, reference, SNPs, INDELs)
+    logger.info("Total Number of STRs : {}".format(len(STRs)))
+
+    output_file_name = output_path(args, "str_", input_paths(args)[2])
+    output_to_file({'STR': STRs}, output_file_name, variant_file_name(output_file_name))
+
+
+def run_catalogue(args):
+    """
+    :return: builds the STR catalogue of every reference record, or loads it from the cache, and writes the STRs
+             of the regions and motifs asked for
+    """
+    reference_file_path, _, base_name = input_paths(args)
+    catalogue = str_catalogue.get_str_catalogue(reference_file_path, args.cache, args.workers)
+    logger.info("STR catalogue of {} records holds {} STRs".format(len(catalogue.names), len(catalogue)))
+
+    rows = []
+    for region in args.region or []:
+        rows.extend(catalogue.overlapping(*str_catalogue.parse_region(region, catalogue)).tolist())
+    for STR in args.motif or []:
+        rows.extend(catalogue.motif(STR, args.exact_motif).tolist())
+    if args.region or args.motif:
+        STRs = catalogue.output_records(sorted(set(rows)))
+        logger.info("STRs found by the queries : {}".format(len(STRs)))
+        output_to_file({'STR': STRs}, output_path(args, "catalogue_", base_name))
+
+
+def build_parser():
+    """
+    :return: parser of the str-finder command line, one sub-command per stage of the pipeline
+    """
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--dataset', type=int, choices=range(len(data_variables.file_name)),
+                        default=data_variables.dataset_choice, help="dataset of data_variables to run on")
+    common.add_argument('--data-folder', default=data_variables.base_folder, help="location of the data files")
+    common.add_argument('--reference', help="reference file, instead of the dataset's")
+    common.add_argument('--record', help="record of the reference to use, the first if not given")
+    common.add_argument('--workers', type=int, default=WORKERS, help="number of worker processes")
+    common.add_argument('--memory-limit', type=int, help="address space limit of every process in MB")
+    common.add_argument('--report', help="JSON report of the time, memory and items of every stage, "
+                                         "<command>.report.json if not given")
+
+    strs = argparse.ArgumentParser(add_help=False)
+    strs.add_argument('--str-threshold', type=int, help="fewest copies of a unit reported as an STR")
+    strs.add_argument('--output', help="output file, prefixed dataset file name if not given")
+
+    donor = argparse.ArgumentParser(add_help=False)
+    donor.add_argument('--full-str-scan', action='store_true',
+                       help="scan the whole donor for STRs instead of only the windows around the variants")
+    donor.add_argument('--genotype-strs', action='store_true',
+                       help="genotype the reference STRs from the reads spanning them instead of reassembling "
+                            "the donor")
+
+    cache = argparse.ArgumentParser(add_help=False)
+    cache.add_argument('--cache', default=data_variables.cache_folder, help="location of the stage cache")
+    cache.add_argument('--cache-budget', type=int, help="size of the stage cache in MB")
+
+    index = argparse.ArgumentParser(add_help=False, parents=[cache])
+    index.add_argument('--read-length', type=int, help="length of each read")
+    index.add_argument('--key-length', type=int, help="parts each read is split into for seeding")
+
+    reads = argparse.ArgumentParser(add_help=False)
+    reads.add_argument('--reads', help="paired-end reads file, instead of the dataset's")
+    reads.add_argument('--snp-threshold', type=int, help="reads needed to call a SNP")
+    reads.add_argument('--max-seed-hits', type=int, help="most reference hits of a seed used for mapping")
+    reads.add_argument('--batch-size', type=int, default=READ_BATCH_SIZE,
+                       help="paired-end reads read and mapped at once")
+
+    parser = argparse.ArgumentParser(prog='str-finder', description="Find STRs, SNPs and INDELs of a donor genome")
+    commands = parser.add_subparsers(dest='command')
+    commands.add_parser('baseline', parents=[common, strs], help="STRs of the reference").set_defaults(
+        run=run_baseline)
+    commands.add_parser('improved', parents=[common, strs, donor, index, reads], help="every stage").set_defaults(
+        run=run_improved)
+    commands.add_parser('index', parents=[common, index], help="k-mer index of the reference").set_defaults(
+        run=run_index)
+    commands.add_parser('map', parents=[common, index, reads], help="SNPs by mapping the reads").set_defaults(
+        run=run_map)
+    commands.add_parser('indels', parents=[common, index, reads], help="INDELs of the unmapped reads").set_defaults(
+        run=run_indels)
+    commands.add_parser('str', parents=[common, strs, donor, index, reads], help="STRs of the donor").set_defaults(
+        run=run_str)
+
+    catalogue = commands.add_parser('catalogue', parents=[common, strs, cache],
+                                    help="STR catalogue of every reference record and queries of it")
+    catalogue.add_argument('--region', action='append',
+                           help="STRs overlapping record or record:start-end, 0-based with exclusive end")
+    catalogue.add_argument('--motif', action='append', help="STRs of the unit or of any rotation of it")
+    catalogue.add_argument('--exact-motif', action='store_true', help="STRs of the motif itself, not its rotations")
+    catalogue.set_defaults(run=run_catalogue)
+
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    try:
+        configure(args)
+    except ValueError as error:
+        parser.error(str(error))
+
+    start_time = time.time()
+    args.run(args)
+    instrumentation.write_report(args.report if args.report is not None else args.command + ".report.json")
+    logger.info("Time to execute {} secs".format(time.time() - start_time))
+    logger.info("Process completed")
+
+
+if __name__ == "__main__":
+    main()
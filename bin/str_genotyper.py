@@ -0,0 +1,238 @@
+import numpy as np
+import logging as logger
+import helpers
+import instrumentation
+from helpers import read_pairs_in_batches, READ_BATCH_SIZE
+from kmer_index import BASE_CODES, INVALID_BASE, encode_bases
+from parallel_helpers import SHARED, WORKERS, run_in_pool
+
+logger.basicConfig(level=logger.INFO, format='> %(message)s')
+
+FLANK_LENGTH = 8  # reference bases on each side of an STR that a read must hold to span it
+MIN_ALLELE_READS = 2  # spanning reads needed to call an allele
+MIN_ALLELE_FRACTION = 0.2  # share of the spanning reads of a locus needed to call an allele
+MAX_ALLELES = 2  # alleles called per locus
+ASCII_BASES = np.frombuffer('ACGTN', dtype=np.uint8)  # 2-bit base code -> ascii, INVALID_BASE -> N
+
+
+def encode_flank_kmers(codes, k=FLANK_LENGTH):
+    """
+    :param codes: 2-bit base codes, one sequence per row
+    :return: integer code of the k-mer starting at every column of every row and whether it holds only valid bases
+    """
+    count = codes.shape[1] - k + 1
+    if count <= 0:
+        return np.zeros((len(codes), 0), dtype=np.uint32), np.zeros((len(codes), 0), dtype=bool)
+
+    kmers = np.zeros((len(codes), count), dtype=np.uint32)
+    for i in xrange(k):
+        kmers <<= 2
+        kmers |= codes[:, i:i + count] & 3
+
+    invalid = np.zeros((len(codes), codes.shape[1] + 1), dtype=np.int64)
+    invalid[:, 1:] = np.cumsum(codes == INVALID_BASE, axis=1)
+    return kmers, invalid[:, k:] == invalid[:, :count]
+
+
+def expand_matches(first, last):
+    """
+    :param first: first table entry matching each query
+    :param last: entry after the last one matching each query
+    :return: index of the query and of the table entry of every match - a query may match several entries
+    """
+    queries = np.flatnonzero(last > first)  # most queries match nothing
+    first, counts = first[queries], last[queries] - first[queries]
+    queries = np.repeat(queries, counts)
+    entries = np.repeat(first - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+    return queries, entries
+
+
+class FlankTable(object):
+    """
+    k-mers of the reference bases just before and just after every catalogue STR - loci sorted by flank code
+    and the offset of each code's block, as in the k-mer index.
+    A read spans an STR when it holds both flanks of the same STR in order, and the bases between them
+    are the donor's repeat tract.
+    """
+
+    def __init__(self, reference, units, starts, repeats, k=FLANK_LENGTH):
+        """
+        :param reference: reference record of the STRs
+        :param units: STR unit of every locus
+        :param starts: reference start of every locus
+        :param repeats: reference repeat count of every locus
+        """
+        self.k = k
+        self.units = list(units)
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.repeats = np.asarray(repeats, dtype=np.int64)
+        self.unit_lengths = np.array([len(unit) for unit in self.units], dtype=np.int64)
+        ends = self.starts + self.repeats * self.unit_lengths
+
+        codes = encode_bases(reference)
+        loci = np.arange(len(self.units))
+        self.left_offsets, self.left_loci = self.flank_table(codes, loci, self.starts - k)
+        self.right_offsets, self.right_loci = self.flank_table(codes, loci, ends)
+
+    def flank_table(self, codes, loci, flank_starts):
+        """
+        :return: offset of each k-mer code's block and the loci whose flank starting at flank_starts has that code
+        """
+        inside = (flank_starts >= 0) & (flank_starts + self.k <= len(codes))
+        loci, flank_starts = loci[inside], flank_starts[inside]
+        kmers, valid = encode_flank_kmers(codes[flank_starts[:, None] + np.arange(self.k)], self.k)
+        kmers, loci = kmers[valid[:, 0], 0], loci[valid[:, 0]]
+
+        offsets = np.zeros(4 ** self.k + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(kmers, minlength=4 ** self.k))
+        return offsets, loci[np.argsort(kmers, kind='mergesort')]
+
+    def __len__(self):
+        return len(self.units)
+
+    def spanning(self, codes):
+        """
+        :param codes: 2-bit base codes of reads of equal length, one per row
+        :return: read, locus, tract start and tract length of every read holding both flanks of a locus in order
+        """
+        kmers, valid = encode_flank_kmers(codes, self.k)
+        columns = kmers.shape[1]
+        if not columns:
+            return (np.zeros(0, dtype=np.int64),) * 4
+        kmers, positions = kmers[valid], np.flatnonzero(valid)  # positions index the flattened rows
+
+        left, left_entries = expand_matches(self.left_offsets[kmers], self.left_offsets[kmers + 1])
+        right, right_entries = expand_matches(self.right_offsets[kmers], self.right_offsets[kmers + 1])
+        left_positions, left_loci = positions[left], self.left_loci[left_entries]
+        right_positions, right_loci = positions[right], self.right_loci[right_entries]
+
+        # pair the flanks of the same locus in the same read - the left one ending before the right one starts
+        left_keys = (left_positions // columns) * len(self) + left_loci
+        right_keys = (right_positions // columns) * len(self) + right_loci
+        order = np.argsort(right_keys, kind='mergesort')
+        pairs, partners = expand_matches(np.searchsorted(right_keys[order], left_keys, side='left'),
+                                         np.searchsorted(right_keys[order], left_keys, side='right'))
+        tract_starts = left_positions[pairs] % columns + self.k
+        tract_lengths = right_positions[order][partners] % columns - tract_starts
+        keep = tract_lengths >= 0
+
+        return left_positions[pairs][keep] // columns, left_loci[pairs][keep], tract_starts[keep], tract_lengths[keep]
+
+    def tract_repeats(self, codes, reads, loci, tract_starts, tract_lengths):
+        """
+        :return: repeat count of every tract made only of whole copies of its locus' unit, -1 for any other tract
+        """
+        repeats = np.full(len(reads), -1, dtype=np.int64)
+        sequences = ASCII_BASES[np.minimum(codes, INVALID_BASE)]
+        for i, (read, locus, start, length) in enumerate(zip(reads.tolist(), loci.tolist(), tract_starts.tolist(),
+                                                             tract_lengths.tolist())):
+            unit = self.units[locus]
+            if length % len(unit) == 0 and sequences[read, start:start + length].tostring() == \
+                    unit * (length // len(unit)):
+                repeats[i] = length // len(unit)
+        return repeats
+
+
+def read_codes(batch, read_length):
+    """
+    :param batch: paired-end reads
+    :return: 2-bit base codes of both ends of every pair and of their reverse complements, one per row -
+             ends of another length are left out
+    """
+    ends = [end for read in batch for end in read if len(end) == read_length]
+    if not ends:
+        return np.zeros((0, read_length), dtype=np.uint8)
+
+    codes = BASE_CODES[np.frombuffer(''.join(ends), dtype=np.uint8)].reshape(len(ends), read_length)
+    complement = np.where(codes == INVALID_BASE, INVALID_BASE, 3 - codes).astype(np.uint8)[:, ::-1]
+    return np.concatenate((codes, complement))
+
+
+def genotype_read_batch(job):
+    """
+    :param job: (progress, batch of paired-end reads) from read_pairs_in_batches
+    :return: progress, batch size, and locus and repeat count of every read spanning a locus of SHARED flanks
+    """
+    progress, batch = job
+    flanks = SHARED['flanks']
+    codes = read_codes(batch, len(batch[0][0]) if batch else 0)
+    reads, loci, tract_starts, tract_lengths = flanks.spanning(codes)
+
+    repeats = flanks.tract_repeats(codes, reads, loci, tract_starts, tract_lengths)
+    spanning = len(np.unique(reads * len(flanks) + loci))
+
+    # a read counts once per locus - with the first of its flank pairs whose tract is whole copies of the unit
+    accepted = repeats >= 0
+    reads, loci, repeats = reads[accepted], loci[accepted], repeats[accepted]
+    first = np.unique(reads * len(flanks) + loci, return_index=True)[1]
+    instrumentation.count('spanning_reads', spanning)
+    instrumentation.count('tracts_rejected', spanning - len(first))
+
+    return progress, len(batch), loci[first], repeats[first]
+
+
+def call_alleles(loci, repeats, locus_count):
+    """
+    :param loci: locus of every spanning read
+    :param repeats: repeat count of every spanning read
+    :return: for every locus, (repeat count, reads) of its called alleles, most supported first
+    """
+    alleles = [[] for _ in xrange(locus_count)]
+    if not len(loci):
+        return alleles
+
+    keys, support = np.unique(np.stack((loci, repeats), axis=1), axis=0, return_counts=True)
+    totals = np.bincount(keys[:, 0], weights=support, minlength=locus_count)
+    for (locus, count), reads in zip(keys.tolist(), support.tolist()):
+        if reads >= MIN_ALLELE_READS and reads >= MIN_ALLELE_FRACTION * totals[locus]:
+            alleles[locus].append((count, reads))
+
+    for locus_alleles in alleles:
+        locus_alleles.sort(key=lambda allele: (-allele[1], allele[0]))
+        del locus_alleles[MAX_ALLELES:]
+    return alleles
+
+
+def genotype_strs(reference, catalogue, reads_file_path, workers=WORKERS, batch_size=READ_BATCH_SIZE):
+    """
+    :param reference: reference record
+    :param catalogue: STR catalogue holding the record
+    :param reads_file_path: location of the paired-end reads
+    :return: (STR unit, reference start, reference repeats, alleles) of every catalogue STR of the record -
+             alleles are (repeat count, reads) counted in the reads that span the STR, empty if none does
+    """
+    rows = catalogue.record_strs(reference.name)
+    units = catalogue.units[rows].tolist()
+    starts, repeats = catalogue.starts[rows], catalogue.repeats[rows]
+    flanks = FlankTable(reference, units, starts, repeats)
+    logger.info("Genotyping {} STRs from the reads spanning them".format(len(flanks)))
+
+    all_loci, all_repeats = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)]
+    count = 0
+    with instrumentation.stage('str_genotyping') as record:
+        for progress, size, loci, read_repeats in run_in_pool(genotype_read_batch,
+                                                              read_pairs_in_batches(reads_file_path, batch_size),
+                                                              workers, flanks=flanks):
+            all_loci.append(loci)
+            all_repeats.append(read_repeats)
+            count += size
+            logger.info("Genotyping STRs. Completed {} %".format(str(100 * progress)[:5]))
+        record.items = count
+
+    alleles = call_alleles(np.concatenate(all_loci), np.concatenate(all_repeats), len(flanks))
+    logger.info("STRs spanned by enough reads : {}".format(sum(1 for locus_alleles in alleles if locus_alleles)))
+    return zip(units, starts.tolist(), repeats.tolist(), alleles)
+
+
+def genotyped_strs(genotypes):
+    """
+    :param genotypes: STR genotypes from genotype_strs
+    :return: STRs of the donor at their reference positions - an STR no read spans keeps its reference length,
+             alleles shorter than the STR threshold are no longer STRs
+    """
+    STRs = []
+    for unit, start, repeats, alleles in genotypes:
+        for count in ([allele[0] for allele in alleles] or [repeats]):
+            if count >= helpers.STR_THRESHOLD:
+                STRs.append([unit * count, start])
+    return STRs
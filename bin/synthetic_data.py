@@ -0,0 +1,180 @@
+import os
+import numpy as np
+import logging as logger
+from variant_writer import VariantWriter
+
+logger.basicConfig(level=logger.INFO, format='> %(message)s')
+
+BASES = np.frombuffer('ACGT', dtype=np.uint8)
+READ_LENGTH = 50  # length of each end of a synthetic pair
+INSERT_MEAN = 250  # mean distance from the start of the forward end to the end of the reverse end
+INSERT_DEVIATION = 10
+STR_SPACING = 1500  # bases between planted STRs
+VARIANT_SPACING = 100  # fewest bases between planted variants, so every variant can be called on its own
+STR_FLANK = 30  # bases kept free of variants on both sides of a planted STR
+SNP_RATE = 1 / 500.0  # planted SNPs per reference base
+INDEL_RATE = 1 / 2000.0  # planted insertions and deletions per reference base
+MAX_INDEL = 5  # longest planted insertion or deletion
+MATCH_TOLERANCE = 5  # bases a called position may be off from the planted one
+
+
+class SyntheticGenome(object):
+    """
+    Random reference with planted STRs, and a donor derived from it by planted SNPs, insertions and deletions.
+    Planted variants are kept apart from each other and from the STRs, so each is the truth for one call.
+    """
+
+    def __init__(self, genome_size, seed=0, snp_rate=SNP_RATE, indel_rate=INDEL_RATE):
+        """
+        :param genome_size: length of the reference
+        :param seed: seed of the random generator - the same seed gives the same genome, donor and reads
+        """
+        self.random = np.random.RandomState(seed)
+        reference = BASES[self.random.randint(0, 4, genome_size)]
+
+        # STRs of 2 to 5 base units, 5 to 10 copies each
+        self.STRs = []
+        free = np.ones(genome_size, dtype=bool)
+        for position in xrange(STR_SPACING / 3, genome_size - STR_SPACING / 3, STR_SPACING):
+            unit = BASES[self.random.randint(0, 4, self.random.randint(2, 6))].tostring()
+            if len(set(unit)) == 1:  # homopolymers are found as STRs of every unit length
+                unit = unit[0] + 'ACGT'[('ACGT'.index(unit[0]) + 1) % 4] + unit[2:]
+            STR = unit * self.random.randint(5, 11)
+            reference[position:position + len(STR)] = np.frombuffer(STR, dtype=np.uint8)
+            free[max(0, position - STR_FLANK):position + len(STR) + STR_FLANK] = False
+            self.STRs.append([STR, position])
+        self.reference = reference.tostring()
+
+        # variants on a grid of sites clear of the STRs, in reference order
+        sites = np.arange(VARIANT_SPACING, genome_size - VARIANT_SPACING, VARIANT_SPACING)
+        sites = sites[free[sites] & free[np.minimum(sites + MAX_INDEL, genome_size - 1)]]
+        sites = self.random.permutation(sites)
+        snp_count = min(len(sites), int(genome_size * snp_rate))
+        indel_count = min(len(sites) - snp_count, int(genome_size * indel_rate))
+
+        self.SNPs = []
+        for position in sorted(sites[:snp_count].tolist()):
+            reference_base = self.reference[position]
+            donor_base = 'ACGT'[('ACGT'.index(reference_base) + self.random.randint(1, 4)) % 4]
+            self.SNPs.append([reference_base, donor_base, position])
+
+        self.insertions, self.deletions = [], []
+        for position in sorted(sites[snp_count:snp_count + indel_count].tolist()):
+            length = self.random.randint(1, MAX_INDEL + 1)
+            if self.random.rand() < 0.5:
+                self.insertions.append((BASES[self.random.randint(0, 4, length)].tostring(), position))
+            else:
+                self.deletions.append((self.reference[position:position + length], position))
+
+        self.donor = self.make_donor()
+
+    def make_donor(self):
+        """
+        :return: donor sequence - the reference with every planted variant applied
+        """
+        donor = bytearray(self.reference)
+        for reference_base, donor_base, position in self.SNPs:
+            donor[position] = donor_base
+
+        events = [(position, string, True) for string, position in self.insertions] + \
+                 [(position, string, False) for string, position in self.deletions]
+        parts, cursor = [], 0
+        for position, string, inserted in sorted(events):
+            parts.append(str(donor[cursor:position]))
+            if inserted:
+                parts.append(string)
+                cursor = position
+            else:
+                cursor = position + len(string)
+        parts.append(str(donor[cursor:]))
+
+        return ''.join(parts)
+
+    def truth(self):
+        """
+        :return: planted variants as sections of an output file
+        """
+        return {'SNP': self.SNPs, 'STR': self.STRs, 'INS': self.insertions, 'DEL': self.deletions}
+
+    def write_reference(self, reference_file_name, line_length=80):
+        with open(reference_file_name, 'w') as f:
+            f.write('>synthetic\n')
+            for i in xrange(0, len(self.reference), line_length):
+                f.write(self.reference[i:i + line_length] + '\n')
+
+    def write_reads(self, reads_file_name, coverage, error_rate=0.0, batch_size=100000):
+        """
+        :param coverage: average number of reads covering a donor base
+        :param error_rate: chance of each read base being replaced by another base
+        :return: writes paired-end reads of the donor - the second end reverse complemented, the ends in random order
+        """
+        donor = np.frombuffer(self.donor, dtype=np.uint8)
+        codes = np.zeros(256, dtype=np.uint8)
+        codes[BASES] = np.arange(4)
+        donor_codes = codes[donor]
+        pair_count = int(len(donor) * coverage / (2 * READ_LENGTH))
+        columns = np.arange(READ_LENGTH)
+
+        with open(reads_file_name, 'w') as f:
+            f.write('>synthetic reads\n')
+            for first in xrange(0, pair_count, batch_size):
+                size = min(batch_size, pair_count - first)
+                inserts = np.clip(self.random.normal(INSERT_MEAN, INSERT_DEVIATION, size).astype(np.int64),
+                                  2 * READ_LENGTH, len(donor))
+                starts = self.random.randint(0, max(1, len(donor) - inserts.max() + 1), size)
+                forward = donor_codes[starts[:, None] + columns]
+                reverse = 3 - donor_codes[(starts + inserts - READ_LENGTH)[:, None] + columns][:, ::-1]
+
+                ends = np.concatenate((forward, reverse))
+                errors = self.random.rand(*ends.shape) < error_rate
+                ends[errors] = (ends[errors] + self.random.randint(1, 4, errors.sum())) % 4
+                forward, reverse = ends[:size], ends[size:]
+
+                swap = self.random.rand(size) < 0.5
+                forward[swap], reverse[swap] = reverse[swap], forward[swap].copy()
+                lines = np.hstack((BASES[forward], np.full((size, 1), ord(','), dtype=np.uint8),
+                                   BASES[reverse], np.full((size, 1), ord('\n'), dtype=np.uint8)))
+                f.write(lines.tostring())
+
+    def write_dataset(self, folder, coverage, error_rate=0.0):
+        """
+        :return: locations of the reference, reads and truth files written to folder
+        """
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        reference_file_name = os.path.join(folder, 'ref_synthetic.txt')
+        reads_file_name = os.path.join(folder, 'reads_synthetic.txt')
+        truth_file_name = os.path.join(folder, 'truth_synthetic.txt')
+
+        self.write_reference(reference_file_name)
+        self.write_reads(reads_file_name, coverage, error_rate)
+        with VariantWriter(truth_file_name) as writer:
+            for key, records in sorted(self.truth().items()):
+                writer.write_section(key, records)
+        logger.info("Synthetic genome of {} bases - {} STRs, {} SNPs, {} INS, {} DEL".format(
+            len(self.reference), len(self.STRs), len(self.SNPs), len(self.insertions), len(self.deletions)))
+
+        return reference_file_name, reads_file_name, truth_file_name
+
+
+def score_calls(truth, calls, tolerance=MATCH_TOLERANCE):
+    """
+    :param truth: planted records of a section, position last
+    :param calls: called records of the same section, position last
+    :return: recall and precision of the calls - a call matches an unmatched planted record within tolerance bases
+    """
+    planted = sorted(int(record[-1]) for record in truth)
+    called = sorted(int(record[-1]) for record in calls)
+    matched = np.zeros(len(planted), dtype=bool)
+    true_calls = 0
+    for position in called:
+        first = np.searchsorted(planted, position - tolerance, side='left')
+        last = np.searchsorted(planted, position + tolerance, side='right')
+        free = np.flatnonzero(~matched[first:last])
+        if len(free):
+            matched[first + free[0]] = True
+            true_calls += 1
+
+    return {'planted': len(planted), 'called': len(called),
+            'recall': round(matched.mean(), 4) if len(planted) else 1.0,
+            'precision': round(true_calls / float(len(called)), 4) if len(called) else 1.0}
@@ -0,0 +1,198 @@
+import os
+import zlib
+import heapq
+import tempfile
+import instrumentation
+from bisect import bisect_left
+
+WRITE_BUFFER = 1 << 20  # bytes buffered by the output files before each write
+BLOCK_SIZE = 1 << 16  # uncompressed bytes of records per compressed block
+GZIP_BITS = 31  # zlib window bits for gzip members, so the block file reads with zcat
+TAILS = ('CNV', 'ALU', 'INV')  # empty sections closing the answer file
+
+
+def format_record(record):
+    """
+    :param record: [reference base, donor base, position] for a SNP, [string, position] for STRs and indels
+    :return: comma separated line of the record
+    """
+    return ",".join(str(field) for field in record) + "\n"
+
+
+class VariantWriter(object):
+    """
+    Answer file written one section at a time, as each stage of the pipeline produces its variants.
+    With an indexed file location, the same records are also sorted into a block-compressed file
+    that can be queried by position with fetch_variants.
+    """
+
+    def __init__(self, file_name, indexed_file_name=None):
+        """
+        :param file_name: location of the answer file
+        :param indexed_file_name: location of the sorted, block-compressed variant file - not written if None
+        """
+        self.file = open(file_name, "w", WRITE_BUFFER)
+        self.file.write(">" + os.path.basename(file_name).split('.')[0] + "\n")
+        self.indexed_file_name = indexed_file_name
+        self.runs = []  # temporary files of sorted records, one per section
+
+    def write_section(self, key, records):
+        """
+        :param key: section name - SNP, STR, INS or DEL
+        :param records: list of the variants of the section, position last
+        """
+        with instrumentation.stage('output') as stage_record:
+            stage_record.items = len(records)
+            self.file.write(">{}\n".format(key))
+            lines = []
+            for record in records:
+                lines.append(format_record(record))
+                if len(lines) >= 4096:  # write in bulk without building the whole section
+                    self.file.write(''.join(lines))
+                    lines = []
+            self.file.write(''.join(lines))
+
+            if self.indexed_file_name is not None:
+                self.add_run(key, records)
+
+    def add_run(self, key, records):
+        """
+        :return: spill the records of a section, sorted by position, to a temporary file
+        """
+        run = tempfile.TemporaryFile()
+        for record in sorted(records, key=lambda record: int(record[-1])):
+            run.write("{}\t{}\t{}".format(int(record[-1]), key, format_record(record)))
+        run.seek(0)
+        self.runs.append(run)
+
+    def close(self):
+        """
+        :return: write the closing sections, and merge the sorted sections into the indexed file
+        """
+        with instrumentation.stage('output'):
+            self.file.write('\n'.join('>' + tail for tail in TAILS))
+            self.file.close()
+
+            if self.indexed_file_name is not None:
+                lines = heapq.merge(*[((int(line.split('\t', 1)[0]), line) for line in run) for run in self.runs])
+                write_indexed_variants(self.indexed_file_name, (line for position, line in lines))
+                for run in self.runs:
+                    run.close()
+                self.runs = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def index_path(indexed_file_name):
+    """
+    :return: location of the block index of an indexed variant file
+    """
+    return indexed_file_name + ".bix"
+
+
+def write_indexed_variants(indexed_file_name, lines):
+    """
+    :param indexed_file_name: location of the block-compressed variant file
+    :param lines: "position<tab>section<tab>record" lines in position order
+    :return: writes the lines in independently compressed blocks, and an index with the first and last
+             position, offset and size of every block
+    """
+    blocks = []
+
+    with open(indexed_file_name, "wb") as out:
+        def flush(block, first, last):
+            compressor = zlib.compressobj(6, zlib.DEFLATED, GZIP_BITS)
+            data = compressor.compress(''.join(block)) + compressor.flush()
+            blocks.append((first, last, out.tell(), len(data)))
+            out.write(data)
+
+        block, size, first, last = [], 0, None, None
+        for line in lines:
+            position = int(line.split('\t', 1)[0])
+            if size >= BLOCK_SIZE and position != last:  # records at one position stay in one block
+                flush(block, first, last)
+                block, size = [], 0
+            if not block:
+                first = position
+            block.append(line)
+            size += len(line)
+            last = position
+        if block:
+            flush(block, first, last)
+
+    with open(index_path(indexed_file_name), "w") as f:
+        for block in blocks:
+            f.write("{}\t{}\t{}\t{}\n".format(*block))
+
+
+def read_variant_index(indexed_file_name):
+    """
+    :return: first position, last position, offset and size of every block of an indexed variant file
+    """
+    blocks = []
+    with open(index_path(indexed_file_name), "r") as f:
+        for line in f:
+            blocks.append(tuple(int(field) for field in line.split('\t')))
+    return blocks
+
+
+def fetch_variants(indexed_file_name, start, end, blocks=None):
+    """
+    :param indexed_file_name: location of the block-compressed variant file
+    :param start: first reference position of the region
+    :param end: reference position after the region
+    :param blocks: block index, read from the index file if not given
+    :return: (section, record fields) of every variant positioned in the region, in position order
+    """
+    if blocks is None:
+        blocks = read_variant_index(indexed_file_name)
+    last_positions = [block[1] for block in blocks]
+
+    variants = []
+    with open(indexed_file_name, "rb") as f:
+        for first, last, offset, size in blocks[bisect_left(last_positions, start):]:
+            if first >= end:
+                break
+            f.seek(offset)
+            for line in zlib.decompress(f.read(size), GZIP_BITS).splitlines():
+                position, key, record = line.split('\t')
+                if start <= int(position) < end:
+                    variants.append((key, record.split(',')))
+
+    return variants
+
+
+def variant_file_name(file_name):
+    """
+    :return: location of the indexed variant file that goes with an answer file
+    """
+    return os.path.splitext(file_name)[0] + ".variants.gz"
+
+
+def record_file_name(file_name, record):
+    """
+    :return: location of the answer file of one record of a reference with several records
+    """
+    root, extension = os.path.splitext(file_name)
+    return "{}_{}{}".format(root, record, extension)
+
+
+def read_output_file(file_name):
+    """
+    :return: record fields of every section of an answer file, by section name
+    """
+    sections = {}
+    records = None
+    with open(file_name, 'r') as f:
+        f.readline()  # omit the name of the output
+        for line in f:
+            line = line.strip()
+            if line.startswith('>'):
+                records = sections.setdefault(line[1:], [])
+            elif line and records is not None:
+                records.append(line.split(','))
+    return sections
@@ -0,0 +1,25 @@
+import os
+import sys
+import logging as logger
+
+BIN_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bin')  # modules under test
+sys.path.insert(0, BIN_FOLDER)
+
+logger.disable(logger.INFO)
+
+LEFT_FLANK = 'GATCCAGTCA' * 3  # ends clear of a repeat after it, and is periodic - a read may hold its k-mers twice
+RIGHT_FLANK = 'CATCAGGCAA' * 3
+
+
+class Record(str):
+    """
+    Reference record as load_reference returns it - a sequence with a name.
+    """
+    name = 'chr1'
+
+
+def dinucleotide_reference(repeats=10):
+    """
+    :return: reference record holding TG * repeats between the flanks, starting at len(LEFT_FLANK)
+    """
+    return Record(LEFT_FLANK + 'TG' * repeats + RIGHT_FLANK)
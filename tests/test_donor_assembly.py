@@ -0,0 +1,44 @@
+import unittest
+
+from fixtures import LEFT_FLANK, dinucleotide_reference
+from donor_assembly import DonorAssembly
+from improved_helpers import find_reference_position
+
+REFERENCE = dinucleotide_reference()  # TG * 10 at 30
+
+
+class DonorAssemblyTest(unittest.TestCase):
+
+    def test_positions_without_variants_are_the_same(self):
+        assembly = DonorAssembly(REFERENCE, [], [], [])
+        positions = range(len(REFERENCE))
+        self.assertEqual(assembly.donor_to_reference_batch(positions).tolist(), positions)
+        self.assertEqual(assembly.reference_to_donor_batch(positions).tolist(), positions)
+
+    def test_inserted_bases_map_to_their_insertion_site(self):
+        assembly = DonorAssembly(REFERENCE, [], [('AC', 20)], [])
+        self.assertEqual(assembly.sequence(), REFERENCE[:20] + 'AC' + REFERENCE[20:])
+        self.assertEqual(assembly.donor_to_reference_batch([19, 20, 21, 22]).tolist(), [19, -1, -1, 20])
+        self.assertEqual(assembly.donor_to_reference_batch([19, 20, 21, 22], insertion_sites=True).tolist(),
+                         [19, 20, 20, 20])
+        self.assertEqual(assembly.donor_to_reference_batch([-1, len(assembly)], insertion_sites=True).tolist(),
+                         [-1, -1])
+
+
+class FindReferencePositionTest(unittest.TestCase):
+
+    def test_str_keeps_its_reference_start(self):
+        # the baseline mapped donor position p to reference p - 1 - STRs now keep their reference start
+        assembly = DonorAssembly(REFERENCE, [['A', 'T', 5]], [('GGG', 50)], [('TC', 12)])
+        donor_start = REFERENCE.index('TG' * 10) - 2  # two bases deleted before the STR
+        self.assertEqual(assembly.sequence()[donor_start:donor_start + 20], 'TG' * 10)
+        self.assertEqual(find_reference_position([['TG' * 10, donor_start]], assembly), [['TG' * 10, len(LEFT_FLANK)]])
+
+    def test_str_on_inserted_bases_is_at_the_insertion(self):
+        assembly = DonorAssembly(REFERENCE, [], [('AC' * 6, 45)], [])
+        self.assertEqual(find_reference_position([['AC' * 6, 45], ['CA' * 5, 46]], assembly),
+                         [['AC' * 6, 45], ['CA' * 5, 45]])
+
+
+if __name__ == '__main__':
+    unittest.main()
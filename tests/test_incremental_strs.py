@@ -0,0 +1,70 @@
+import random
+import unittest
+
+from fixtures import Record
+import str_catalogue
+from donor_assembly import DonorAssembly
+from improved_helpers import get_incremental_tandem_repeats, get_tandem_repeats
+
+
+def random_case(rng, length):
+    """
+    :return: reference with planted STRs, and SNPs, insertions and deletions - many at the edges of the STRs
+    """
+    bases = [rng.choice('ACGT') for _ in xrange(length)]
+    edges = []
+    for start in xrange(0, length, rng.randint(40, 200)):
+        STR = ''.join(rng.choice('ACGT') for _ in xrange(rng.randint(1, 5))) * rng.randint(2, 12)
+        bases[start:start + len(STR)] = list(STR)
+        edges.extend((start, start + len(STR)))
+    reference = ''.join(bases)[:length]
+    edges = [edge for edge in edges if edge < length]
+
+    def position(end):
+        if edges and rng.random() < 0.5:
+            return min(end - 1, max(0, rng.choice(edges) + rng.randint(-2, 2)))
+        return rng.randint(0, end - 1)
+
+    SNPs = {}
+    for _ in xrange(rng.randint(0, length // 30 + 1)):
+        snp = position(length)
+        SNPs[snp] = [reference[snp], rng.choice([base for base in 'ACGT' if base != reference[snp]]), snp]
+
+    insertions, deletions = [], []
+    for _ in xrange(rng.randint(0, length // 60 + 1)):
+        indel = position(length + 1)
+        if rng.random() < 0.5:
+            insertions.append((''.join(rng.choice('ACGT') for _ in xrange(rng.randint(1, 3))) * rng.randint(1, 8),
+                               indel))
+        elif indel < length:
+            deletions.append((reference[indel:indel + rng.randint(1, 12)], indel))
+
+    return Record(reference), sorted(SNPs.values(), key=lambda snp: snp[2]), \
+        sorted(insertions, key=lambda ins: ins[1]), sorted(deletions, key=lambda dels: dels[1])
+
+
+class IncrementalTandemRepeatsTest(unittest.TestCase):
+
+    def test_rescan_gives_the_full_scan(self):
+        rng = random.Random(22)
+        for case in xrange(150):
+            reference, SNPs, insertions, deletions = random_case(rng, rng.choice([10, 50, 300, 2000]))
+            donor_assembly = DonorAssembly(reference, SNPs, insertions, deletions)
+            donor = donor_assembly.sequence()
+            catalogue = str_catalogue.build_str_catalogue([reference], workers=1)
+
+            incremental = get_incremental_tandem_repeats(reference, catalogue, donor, donor_assembly, SNPs,
+                                                         (deletions, insertions))
+            self.assertEqual(incremental, get_tandem_repeats(donor, workers=1), case)
+
+    def test_no_variants_keeps_the_reference_strs(self):
+        reference = Record('GATCCAGTCA' + 'AC' * 8 + 'GATTACA' + 'TTG' * 6 + 'CCAG')
+        catalogue = str_catalogue.build_str_catalogue([reference], workers=1)
+        donor_assembly = DonorAssembly(reference, [], [], [])
+        self.assertEqual(get_incremental_tandem_repeats(reference, catalogue, str(reference), donor_assembly, [],
+                                                        ([], [])),
+                         get_tandem_repeats(str(reference), workers=1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,28 @@
+import unittest
+
+import fixtures  # puts bin/ on the path
+from pileup import Pileup, VariationTally
+
+
+class PileupTest(unittest.TestCase):
+
+    def test_worker_tallies_merge_into_the_same_counts(self):
+        positions = [5, 5, 5, 70000, 70000, -1, 9]
+        bases = ['C', 'C', 'G', 'T', 'T', 'A', 'N']  # negative positions and N bases are not counted
+        pileup, merged = Pileup(), Pileup()
+        pileup.add(positions, bases)
+        for half in (slice(0, 3), slice(3, None)):
+            tally = VariationTally()
+            tally.add(positions[half], bases[half])
+            merged.merge(tally)
+
+        for called in (pileup.call(2), merged.call(2)):
+            self.assertEqual([column.tolist() for column in called], [[5, 70000], [1, 3]])
+        self.assertEqual((len(pileup), len(merged)), (2, 2))
+
+        merged.clear()
+        self.assertEqual(len(merged), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import random
+import unittest
+
+import fixtures  # puts bin/ on the path
+from smith_waterman_align import match_score, gap_penalty, add_symbols, waterman_algorithm, \
+    waterman_algorithm_batch
+
+
+def cell_by_cell_alignment(seq_1, seq_2):
+    """
+    :return: local alignment as the original waterman_algorithm computed it, one cell at a time -
+             False, False if it is empty
+    """
+    m, n = len(seq_1), len(seq_2)
+    score = [[0] * (n + 1) for _ in xrange(m + 1)]
+    pointer = [[0] * (n + 1) for _ in xrange(m + 1)]
+
+    max_score, max_i, max_j = 0, 0, 0
+    for i in xrange(1, m + 1):
+        for j in xrange(1, n + 1):
+            score_diagonal = score[i - 1][j - 1] + match_score(seq_1[i - 1], seq_2[j - 1])
+            score_up = score[i][j - 1] + gap_penalty
+            score_left = score[i - 1][j] + gap_penalty
+            score[i][j] = max(0, score_left, score_up, score_diagonal)
+            if score[i][j] == score_left:
+                pointer[i][j] = 1
+            if score[i][j] == score_up:
+                pointer[i][j] = 2
+            if score[i][j] == score_diagonal:
+                pointer[i][j] = 3
+            if score[i][j] >= max_score:
+                max_i, max_j, max_score = i, j, score[i][j]
+
+    align_1, align_2 = '', ''
+    i, j = max_i, max_j
+    while pointer[i][j] != 0:
+        if pointer[i][j] == 3:
+            align_1, align_2, i, j = align_1 + seq_1[i - 1], align_2 + seq_2[j - 1], i - 1, j - 1
+        elif pointer[i][j] == 2:
+            align_1, align_2, j = align_1 + '-', align_2 + seq_2[j - 1], j - 1
+        else:
+            align_1, align_2, i = align_1 + seq_1[i - 1], align_2 + '-', i - 1
+
+    if not align_1:
+        return False, False
+    return add_symbols(align_1, align_2)
+
+
+def random_pair(rng):
+    """
+    :return: a reference window and a read taken from it with mismatches, insertions and deletions
+    """
+    window = ''.join(rng.choice('ACGT') for _ in xrange(rng.randint(1, 70)))
+    start = rng.randint(0, len(window) - 1)
+    read = list(window[start:start + rng.randint(1, 50)])
+    for _ in xrange(rng.randint(0, 3)):
+        position = rng.randint(0, len(read))
+        change = rng.choice(('mismatch', 'insertion', 'deletion'))
+        if change == 'mismatch' and position < len(read):
+            read[position] = rng.choice('ACGTN')
+        elif change == 'insertion':
+            read.insert(position, rng.choice('ACGT') * rng.randint(1, 4))
+        elif position < len(read):
+            del read[position:position + rng.randint(1, 4)]
+    return window, ''.join(read) or rng.choice('ACGT')
+
+
+class WatermanAlgorithmTest(unittest.TestCase):
+
+    def test_matches_the_cell_by_cell_fill(self):
+        rng = random.Random(7)
+        pairs = [random_pair(rng) for _ in xrange(400)]
+        expected = [cell_by_cell_alignment(seq_1, seq_2) for seq_1, seq_2 in pairs]
+
+        self.assertEqual(waterman_algorithm_batch(pairs), expected)  # pairs of different lengths padded together
+        for (seq_1, seq_2), alignment in zip(pairs[:50], expected):
+            self.assertEqual(waterman_algorithm(seq_1, seq_2), alignment)
+
+    def test_sequences_without_a_match(self):
+        self.assertEqual(waterman_algorithm('AAAA', 'CCC'), (False, False))
+        self.assertEqual(waterman_algorithm('', 'CCC'), (False, False))
+
+
+if __name__ == '__main__':
+    unittest.main()
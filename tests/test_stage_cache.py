@@ -0,0 +1,53 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import fixtures  # puts bin/ on the path
+import stage_cache
+
+MODIFIED = 1000000000  # whole seconds, which every file system keeps exactly
+
+
+class FileDigestTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.cache_folder = os.path.join(self.folder, 'cache')
+        self.file_path = os.path.join(self.folder, 'reads.txt')
+        with open(self.file_path, 'w') as f:
+            f.write('ACGT,TGCA\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+        stage_cache.DIGESTS.clear()
+        stage_cache.LOADED_DIGESTS.clear()
+
+    def forget_digests(self):
+        # as a new run starts
+        stage_cache.DIGESTS.clear()
+        stage_cache.LOADED_DIGESTS.clear()
+
+    def test_later_runs_read_the_digest_from_the_cache_folder(self):
+        os.utime(self.file_path, (MODIFIED, MODIFIED))
+        key = stage_cache.stage_key('snps', [self.file_path], cache_folder=self.cache_folder)
+        self.forget_digests()
+
+        # same size and modification time - a run that hashed the file again would see the new contents
+        with open(self.file_path, 'w') as f:
+            f.write('TTTT,AAAA\n')
+        os.utime(self.file_path, (MODIFIED, MODIFIED))
+        self.assertEqual(stage_cache.stage_key('snps', [self.file_path], cache_folder=self.cache_folder), key)
+        self.forget_digests()
+        self.assertNotEqual(stage_cache.stage_key('snps', [self.file_path]), key)
+
+    def test_changed_file_is_hashed_again(self):
+        key = stage_cache.stage_key('snps', [self.file_path], cache_folder=self.cache_folder)
+        self.forget_digests()
+        with open(self.file_path, 'a') as f:
+            f.write('GGGG,CCCC\n')
+        self.assertNotEqual(stage_cache.stage_key('snps', [self.file_path], cache_folder=self.cache_folder), key)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import fixtures  # puts bin/ on the path
+import improved_helpers
+from reference import load_reference
+
+
+class StageKeysTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.reference_file_path = os.path.join(self.folder, 'ref.txt')
+        self.reads_file_path = os.path.join(self.folder, 'reads.txt')
+        with open(self.reference_file_path, 'w') as f:
+            f.write('>chr1\n' + 'ACGTTGCA' * 20 + '\n')
+        with open(self.reads_file_path, 'w') as f:
+            f.write('>reads\n' + 'ACGT' * 12 + 'AC,' + 'TGCA' * 12 + 'TG\n')
+        self.key_length = improved_helpers.KEY_LENGTH
+
+    def tearDown(self):
+        improved_helpers.KEY_LENGTH = self.key_length
+        shutil.rmtree(self.folder)
+
+    def keys(self, key_length):
+        improved_helpers.KEY_LENGTH = key_length
+        return improved_helpers.get_stage_keys(load_reference(self.reference_file_path), self.reference_file_path,
+                                               self.reads_file_path)
+
+    def test_key_lengths_of_the_same_k_share_the_index_but_not_the_snps(self):
+        # with 50 base reads both give 5-mers, but they accept different numbers of mismatches
+        index_9, snps_9, indels_9 = self.keys(9)
+        index_10, snps_10, indels_10 = self.keys(10)
+        self.assertEqual(index_9, index_10)
+        self.assertNotEqual(snps_9, snps_10)
+        self.assertNotEqual(indels_9, indels_10)
+
+
+if __name__ == '__main__':
+    unittest.main()
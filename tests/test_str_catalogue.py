@@ -0,0 +1,76 @@
+import os
+import shutil
+import tempfile
+import unittest
+from collections import OrderedDict
+
+from fixtures import LEFT_FLANK, dinucleotide_reference
+import instrumentation
+import str_catalogue
+from helpers import find_clean_cut_positions
+
+class CatalogueLociTest(unittest.TestCase):
+
+    def test_shortest_unit_is_kept(self):
+        # TG * 10 is also TGTG * 5 - whichever unit comes first, the locus keeps TG
+        tandem_repeats = OrderedDict([('TGTG', [(30, 5)]), ('TG', [(30, 10)])])
+        self.assertEqual(str_catalogue.catalogue_loci(tandem_repeats), [('TGTG', 30, 5, False), ('TG', 30, 10, True)])
+
+
+class StrCatalogueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.reference = dinucleotide_reference()
+        self.catalogue = str_catalogue.build_str_catalogue([self.reference], workers=1)
+
+    def test_dinucleotide_locus(self):
+        rows = self.catalogue.record_strs('chr1')
+        self.assertEqual(self.catalogue.loci(rows), [('chr1', 'TG', len(LEFT_FLANK), 10)])
+        self.assertEqual(self.catalogue.output_records(rows), [['TG' * 10, len(LEFT_FLANK)]])
+
+    def test_queries_return_processed_rows(self):
+        start = len(LEFT_FLANK)
+        self.assertEqual(self.catalogue.overlapping('chr1', start + 5, start + 6).tolist(),
+                         self.catalogue.record_strs('chr1').tolist())
+        self.assertEqual(self.catalogue.overlapping('chr1', 0, start).tolist(), [])
+        self.assertEqual(self.catalogue.motif('GT').tolist(), self.catalogue.record_strs('chr1').tolist())
+        self.assertEqual(self.catalogue.motif('GT', exact=True).tolist(), [])
+        self.assertEqual(len(self.catalogue), 1)
+
+    def test_rescan_reads_every_hit_and_the_clean_cuts(self):
+        self.assertEqual(sorted(self.catalogue.record_hits('chr1')),
+                         [('TG', len(LEFT_FLANK), 10), ('TGTG', len(LEFT_FLANK), 5)])
+        self.assertEqual(self.catalogue.record_clean_cuts('chr1').tolist(),
+                         find_clean_cut_positions(self.reference).tolist())
+
+    def test_scan_and_catalogue_are_timed_as_separate_stages(self):
+        instrumentation.reset()
+        str_catalogue.build_str_catalogue([self.reference], workers=1)
+        self.assertEqual([record.name for record in instrumentation.STAGES], ['str_detection', 'str_catalogue'])
+        instrumentation.reset()
+
+    def test_unknown_record(self):
+        self.assertRaises(KeyError, self.catalogue.record_strs, 'chr2')
+
+
+class CachedCatalogueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.reference_file_path = os.path.join(self.folder, 'ref.txt')
+        with open(self.reference_file_path, 'w') as f:
+            f.write('>chr1\n' + dinucleotide_reference() + '\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_cached_catalogue_matches_the_built_one(self):
+        cache_folder = os.path.join(self.folder, 'cache')
+        built = str_catalogue.get_str_catalogue(self.reference_file_path, cache_folder, workers=1)
+        cached = str_catalogue.get_str_catalogue(self.reference_file_path, cache_folder, workers=1)
+        self.assertEqual(cached.loci(cached.record_strs('chr1')), built.loci(built.record_strs('chr1')))
+        self.assertEqual(cached.record_hits('chr1'), built.record_hits('chr1'))
+
+
+if __name__ == '__main__':
+    unittest.main()
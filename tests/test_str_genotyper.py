@@ -0,0 +1,56 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from fixtures import LEFT_FLANK, RIGHT_FLANK, dinucleotide_reference
+import str_catalogue
+import str_genotyper
+from parallel_helpers import SHARED
+
+READ_LENGTH = 60
+OTHER_END = 'A' * READ_LENGTH  # mate that spans no STR
+
+
+def spanning_reads(donor):
+    """
+    :return: every read of the donor holding both flanks of the STR, paired with an end that spans nothing
+    """
+    return [[donor[start:start + READ_LENGTH], OTHER_END] for start in xrange(len(donor) - READ_LENGTH + 1)]
+
+
+class GenotypeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.reference = dinucleotide_reference()
+        self.donor = LEFT_FLANK + 'TG' * 11 + RIGHT_FLANK
+        self.catalogue = str_catalogue.build_str_catalogue([self.reference], workers=1)
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+        SHARED.clear()
+
+    def test_dinucleotide_str_grown_by_one_repeat(self):
+        reads = spanning_reads(self.donor)
+        reads_file_path = os.path.join(self.folder, 'reads.txt')
+        with open(reads_file_path, 'w') as f:
+            f.write('>reads\n' + ''.join('{},{}\n'.format(*read) for read in reads))
+
+        genotypes = str_genotyper.genotype_strs(self.reference, self.catalogue, reads_file_path, workers=1)
+        self.assertEqual(genotypes, [('TG', len(LEFT_FLANK), 10, [(11, len(reads))])])
+        self.assertEqual(str_genotyper.genotyped_strs(genotypes), [['TG' * 11, len(LEFT_FLANK)]])
+
+    def test_read_counts_once_with_the_tract_it_accepts(self):
+        # the read starts with the left flank k-mer three times - only the last one borders the tract
+        read = self.donor[:READ_LENGTH]
+        flanks = str_genotyper.FlankTable(self.reference, ['TG'], [len(LEFT_FLANK)], [10])
+        SHARED['flanks'] = flanks
+        self.assertEqual(len(flanks.spanning(str_genotyper.read_codes([[read, OTHER_END]], READ_LENGTH))[0]), 3)
+
+        _, size, loci, repeats = str_genotyper.genotype_read_batch((1.0, [[read, OTHER_END]]))
+        self.assertEqual((size, loci.tolist(), repeats.tolist()), (1, [0], [11]))
+
+
+if __name__ == '__main__':
+    unittest.main()